@@ -1,5 +1,15 @@
 # This Python file uses the following encoding: utf-8
+import time
+STARTUP_TIME = time.perf_counter()
+
 import sys
+from src.startup_timer import StartupTimer, ImportTracer, is_startup_trace_enabled, STARTUP_TRACE_OPTION
+
+import_tracer = ImportTracer() if is_startup_trace_enabled(sys.argv) else None
+if import_tracer is not None:
+    import_tracer.install()
+
+import argparse
 import datetime
 import threading
 import numpy as np
@@ -7,18 +17,22 @@ import cv2
 
 from PySide6 import QtCore
 from PySide6.QtWidgets import QApplication, QWidget, QMessageBox
-from PySide6.QtCore import Qt, QObject, QEvent, QRegularExpression, Signal
-from PySide6.QtGui import QMouseEvent, QRegularExpressionValidator, QIcon, QWheelEvent
+from PySide6.QtCore import Qt, QObject, QEvent, QRegularExpression, Signal, QTimer, QSize
+from PySide6.QtGui import QMouseEvent, QRegularExpressionValidator, QIcon, QWheelEvent, QImage, QPixmap
 
 from src.roi_handler import ROIHandler, ROIState
 from src.socket_handler import SocketHandler
 from src.stream_receiver import StreamReceiver, StreamSize
-from src.viewer import Viewer
-from src.tools import numpy_to_pixmap, scale_pixmap, DebugEmitter
+from src.viewer import Viewer, RenderedFrame
+from src.tools import numpy_to_scaled_image, get_brightness_contrast_lut, DebugEmitter, frame_to_rgb, crop_frame_to_rgb, fit_size, get_frame_size
+from src.overlay import paint_crosshair
+from src.frame_buffer import StreamFrame
+from src.frame_source import FrameSource, FileFrameSource, SyntheticFrameSource, SYNTHETIC_FRAME_SIZE
 from src.command import Command
 from src.zeroconf_handler import ZeroconfHandler
 from src.widgets_text import *
-from src.pipeline import WrapperPipeline
+from src.pipeline import PipelineGraph
+from src.frame_recorder import FrameRecorder
 from src.data import Data
 from src.localization import Localization
 
@@ -28,8 +42,30 @@ from src.localization import Localization
 
 from ui_form import Ui_Widget
 
+if import_tracer is not None:
+    import_tracer.uninstall()
+
 PARAMS_FILE_NAME = "params"
 SAVE_TIMEOUT = 5
+OUTPUT_SIZE_UPDATE_DELAY = 300
+
+# Render graph nodes: the view frame is shared by the view and the recorder,
+# the ROI magnifier and the metrics read the received frame
+VIEW_FRAME_NODE = "view_frame"
+VIEW_NODE = "view"
+RECORDER_NODE = "recorder"
+ROI_NODE = "roi"
+METRICS_NODE = "metrics"
+LOCAL_TRACKER_NODE = "local_tracker"
+
+RENDER_FPS_SMOOTHING = 0.1
+
+# View pipeline order: numpy stages, conversion to the scaled view image, then overlays painted on it
+CONVERT_FRAME_PRIORITY = 0
+CONVERT_IMAGE_PRIORITY = 10
+CROSSHAIR_PRIORITY = 20
+TRAIL_PRIORITY = 25
+ROI_PRIORITY = 30
 
 DEFAULT_LANGUAGE = "en"
 
@@ -39,10 +75,13 @@ class Widget(QWidget):
     stream_size_changed_signal = Signal(tuple)
     language_changed_signal = Signal()
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, startup_timer: StartupTimer = None):
         super().__init__(parent)
+        self.startup_timer = startup_timer if startup_timer is not None else StartupTimer()
+        self.startup_timer.mark("imports and application")
         self.ui = Ui_Widget()
         self.ui.setupUi(self)
+        self.startup_timer.mark("ui setup")
 
         self.ui.send_cfs_push_button.setEnabled(True) # fix
 
@@ -67,38 +106,67 @@ class Widget(QWidget):
         self.ui.sigma_factor_line_edit.setValidator(validator)
 
         self.stream_receiver = StreamReceiver(self)
+        self.roi_preview_active = False
+        self.output_size_timer = QTimer(self)
+        self.output_size_timer.setSingleShot(True)
+        self.output_size_timer.setInterval(OUTPUT_SIZE_UPDATE_DELAY)
+        self.output_size_timer.timeout.connect(self.update_stream_output_size)
 
         self.viewer = Viewer(self, self.stream_receiver)
-        self.viewer.frame_ready_signal.connect(self.update_view_label)
-        self.viewer.frame_ready_signal.connect(self.update_roi_label)
+        self.viewer.frame_ready_signal.connect(self.on_frame_ready)
         self.viewer.play_pressed_signal.connect(self.update_gui_on_play)
         self.viewer.play_pressed_signal.connect(self.start_stream)
         self.viewer.stop_pressed_signal.connect(self.update_gui_on_stop)
         self.viewer.stop_pressed_signal.connect(self.stop_stream)
         self.viewer.stop_pressed_signal.connect(self.ui.roi_label.clear)
+        self.viewer.stop_pressed_signal.connect(lambda: self.render_graph.log_timings())
+        self.viewer.source_frame_size_signal.connect(self.on_source_frame_size)
         self.load_start_state_signal.connect(self.viewer.load_no_connection_view)
         self.toggle_view_signal.connect(self.viewer.toggle_view)
+        self.startup_timer.mark("stream receiver and viewer")
 
         self.roi_handler = ROIHandler(self, self.ui.view_label, self.ui.roi_label, 1/int(self.ui.stream_fps_line_edit.text()))
         self.roi_handler.roi_selected_signal.connect(self.enable_tracking)
         self.viewer.play_pressed_signal.connect(self.roi_handler.enable_roi_selecting)
         self.viewer.stop_pressed_signal.connect(self.roi_handler.disable_roi_selecting)
+        self.viewer.stop_pressed_signal.connect(self.log_roi_estimation_summary)
         self.stream_size_changed_signal.connect(self.roi_handler.set_stream_size)
-        self.toggle_view_signal.connect(lambda: self.roi_handler.set_interpolation_step(1/int(self.ui.stream_fps_line_edit.text())))
-
-        self.view_label_pipeline = WrapperPipeline()
-        self.view_label_pipeline.register_operation(self.draw_crosshair, self.draw_crosshair.__name__)
-        self.view_label_pipeline.register_operation(self.roi_handler.draw_roi, self.roi_handler.draw_roi.__name__)
-        self.view_label_pipeline.register_operation(self.update_view_label, self.update_view_label.__name__)
-
-        self.update_view_label = self.view_label_pipeline.process
+        self.stream_size_changed_signal.connect(lambda size: self.update_stream_output_size())
+
+        self.recorder = None
+        self.rendered_frames_count = 0
+        self.render_fps = 0.0
+        self.last_render_time = None
+
+        self.render_graph = PipelineGraph("render")
+        self.view_frame_pipeline = self.render_graph.add_node(VIEW_FRAME_NODE)
+        self.view_frame_pipeline.register_operation(
+            self.convert_view_frame, self.convert_view_frame.__name__, priority=CONVERT_FRAME_PRIORITY)
+        self.view_label_pipeline = self.render_graph.add_node(VIEW_NODE, VIEW_FRAME_NODE)
+        self.view_label_pipeline.register_operation(
+            self.convert_view_image, self.convert_view_image.__name__, priority=CONVERT_IMAGE_PRIORITY)
+        self.view_label_pipeline.register_operation(
+            self.paint_crosshair, self.paint_crosshair.__name__, mutates_input=True, priority=CROSSHAIR_PRIORITY)
+        self.view_label_pipeline.register_operation(
+            self.roi_handler.paint_roi, self.roi_handler.paint_roi.__name__, mutates_input=True, priority=ROI_PRIORITY)
+        self.view_label_pipeline.register_operation(
+            self.roi_handler.paint_trail, self.roi_handler.paint_trail.__name__, default_enabled=False,
+            mutates_input=True, priority=TRAIL_PRIORITY)
+        self.render_graph.add_node(RECORDER_NODE, VIEW_FRAME_NODE, enabled=False).register_operation(
+            self.record_frame, self.record_frame.__name__)
+        self.render_graph.add_node(ROI_NODE).register_operation(self.render_roi_label, self.render_roi_label.__name__)
+        self.render_graph.add_node(LOCAL_TRACKER_NODE, enabled=False).register_operation(
+            self.roi_handler.submit_tracking_frame, self.roi_handler.submit_tracking_frame.__name__)
+        self.render_graph.add_node(METRICS_NODE).register_operation(
+            self.update_render_metrics, self.update_render_metrics.__name__)
+        self.viewer.set_frame_renderer(self.render_frame)
 
         self.ui.toggle_crosshair_radio_button.toggled.connect(
-            lambda enabled: self.view_label_pipeline.enable_operation(self.draw_crosshair.__name__) if enabled
-            else self.view_label_pipeline.disable_operation(self.draw_crosshair.__name__))
+            lambda enabled: self.view_label_pipeline.enable_operation(self.paint_crosshair.__name__) if enabled
+            else self.view_label_pipeline.disable_operation(self.paint_crosshair.__name__))
         self.ui.toggle_roi_radio_button.toggled.connect(
-            lambda enabled: self.view_label_pipeline.enable_operation(self.roi_handler.draw_roi.__name__) if enabled
-            else self.view_label_pipeline.disable_operation(self.roi_handler.draw_roi.__name__))
+            lambda enabled: self.view_label_pipeline.enable_operation(self.roi_handler.paint_roi.__name__) if enabled
+            else self.view_label_pipeline.disable_operation(self.roi_handler.paint_roi.__name__))
 
         self.ui.toggle_server_roi_radio_button.toggled.connect(
             lambda enabled: self.socket_handler.send(Command.TOGGLE_ROI, True) if enabled
@@ -116,6 +184,7 @@ class Widget(QWidget):
             self.roi_handler.on_key_pressed_try_send_roi,
             self.on_tracker_stop_button_clicked)
         self.installEventFilter(self.key_press_event_filter)
+        self.startup_timer.mark("roi handler and view pipeline")
 
         self.socket_handler = SocketHandler(self)
         self.socket_handler.update_roi_signal.connect(self.on_roi_update)
@@ -126,12 +195,14 @@ class Widget(QWidget):
 
         self.debug = DebugEmitter(self)
         self.debug.debug_signal.connect(self.show_debug_message)
+        self.startup_timer.mark("socket handler")
 
         self.zeroconf_handler = ZeroconfHandler()
         self.zeroconf_handler.listener.service_added_signal.connect(self.viewer.change_stream_url)
         self.zeroconf_handler.listener.service_added_signal.connect(self.on_service_added)
         self.zeroconf_handler.listener.service_added_signal.connect(lambda params: self.viewer.load_connection_established_view())
         self.socket_handler.disconnect_from_server_signal.connect(self.on_disconnect_from_server)
+        self.startup_timer.mark("zeroconf")
 
         self.ui.stream_size_combo_box.addItem("720p")
         self.ui.stream_size_combo_box.addItem("480p")
@@ -144,6 +215,8 @@ class Widget(QWidget):
         self.ui.stream_size_combo_box.currentIndexChanged.connect(self.stream_receiver.change_stream_size_with_index)
         self.stream_receiver.change_stream_size_with_index_signal.connect(self.ui.stream_size_combo_box.setCurrentIndex)
         self.stream_receiver.change_stream_size_with_index_signal.connect(lambda index: self.stream_size_changed_signal.emit(self.stream_receiver.get_stream_size()))
+        self.stream_receiver.stream_size_detected_signal.connect(self.on_stream_size_detected)
+        self.stream_receiver.stream_stats_signal.connect(self.update_stream_stats)
 
         self.ui.roi_width_slider.valueChanged.connect(self.handle_roi_width)
         self.ui.roi_height_slider.valueChanged.connect(self.handle_roi_height)
@@ -181,8 +254,15 @@ class Widget(QWidget):
 
         self.language_changed_signal.connect(self.update_ui_text)
 
+        self.startup_timer.mark("data and localisation")
+
         self.load_saved_parameters()
-        self.loc.set_localisation()
+        # The icon resources are loaded once the event loop runs, so the window is shown first
+        self.loc.set_localisation(update_icon=False)
+        QTimer.singleShot(0, lambda: self.ui.language_tool_button.setIcon(self.loc.icons[self.loc.language]))
+        self.update_roi_label_adjustments()
+        self.update_label_sizes()
+        self.startup_timer.mark("saved parameters")
 
 
     def handle_image_checkbox(self, check_box, state):
@@ -193,6 +273,7 @@ class Widget(QWidget):
             if state == Qt.CheckState.Checked.value:
                 self.ui.stream_quality_group_box.setEnabled(False)
                 self.stream_receiver.change_stream_size_with_index(StreamSize.SIZE_NONE[0])
+                self.viewer.camera_source.request_camera()
 
     def wheelEvent(self, event: QWheelEvent) -> None:
         if self.roi_handler.current_state != ROIState.FAST_SELECTING:
@@ -206,6 +287,7 @@ class Widget(QWidget):
         self.handle_roi_height(new_size)
 
     def update_tracker_data(self, data) -> None:
+        self.roi_handler.update_tracker_data(data)
         plain_text = ''
         for key in data:
             value = data[key]
@@ -228,6 +310,7 @@ class Widget(QWidget):
         self.roi_handler.set_tracking_frame_size(params["tracking_frame_size"])
         self.viewer.set_tracking_frame_size(params["tracking_frame_size"])
         self.stream_receiver.set_stream_size(params["tracking_frame_size"])
+        self.update_stream_output_size()
         self.roi_handler.set_stream_size(params["tracking_frame_size"])
         if self.ui.fast_roi_radio_button.isChecked():
             self.roi_handler.change_state(ROIState.FAST_SELECTING)
@@ -236,6 +319,49 @@ class Widget(QWidget):
         self.socket_handler.send(Command.CHANGE_FRAME_BORDERS, self.get_frame_borders_data())
         self.toggle_view_signal.emit()
 
+    def showEvent(self, event) -> None:
+        super().showEvent(event)
+        if self.startup_timer is not None:
+            self.startup_timer.mark("window shown")
+            summary = self.startup_timer.summary()
+            self.debug.send(summary)
+            self.startup_timer = None
+
+    def use_offline_source(self, source: FrameSource) -> None:
+        self.viewer.set_offline_source(source)
+        self.ui.connection_label.setText(f"Offline source: {source.name}")
+        self.ui.toggle_button.setEnabled(True)
+
+    def on_source_frame_size(self, size) -> None:
+        self.roi_handler.set_tracking_frame_size(size)
+        self.roi_handler.set_stream_size(size)
+
+    def update_stream_stats(self, stats: dict) -> None:
+        bitrate = f"{stats['bitrate']:.0f} kbit/s" if stats["bitrate"] is not None else "N/A"
+        text = (f"fps: {stats['fps']:.1f}, bitrate: {bitrate}\n"
+                f"dropped: {stats['dropped_frames']}, duplicated: {stats['duplicated_frames']}\n"
+                f"decode errors: {stats['decode_errors']}, corrupt packets: {stats['corrupt_packets']}")
+        supervisor_stats = self.stream_receiver.get_supervisor_stats()
+        text += f"\nrestarts: {supervisor_stats['restart_count']}"
+        if supervisor_stats["time_to_first_frame"] is not None:
+            text += f", time to first frame: {supervisor_stats['time_to_first_frame']:.2f} s"
+        decode_time = self.stream_receiver.get_decode_time()
+        if decode_time is not None:
+            text += f"\ndecode time: last {decode_time[0] * 1000:.2f} ms, average {decode_time[1] * 1000:.2f} ms"
+        text += f"\nrender fps: {self.render_fps:.1f}, rendered frames: {self.rendered_frames_count}"
+        text += f"\n{self.viewer.get_latency_summary()}"
+        for summary in (self.roi_handler.get_prediction_summary(), self.roi_handler.get_local_tracker_summary()):
+            if summary is not None:
+                text += f"\n{summary}"
+        self.ui.connection_label.setToolTip(text)
+
+    def on_stream_size_detected(self, size) -> None:
+        index = self.stream_receiver.get_stream_size_index()
+        self.ui.stream_size_combo_box.blockSignals(True)
+        self.ui.stream_size_combo_box.setCurrentIndex(index if index >= 0 else StreamSize.SIZE_NONE[0])
+        self.ui.stream_size_combo_box.blockSignals(False)
+        self.stream_size_changed_signal.emit(size)
+
     def on_roi_update(self, roi) -> None:
         if self.is_tracking_stopped:
             return
@@ -288,11 +414,19 @@ class Widget(QWidget):
         maximum_brightness = self.ui.roi_frame_brightness_slider.maximum()
         brightness = int((1 + value / maximum_brightness) * 100)
         self.ui.roi_brightness_value_label.setText(f"{brightness}%")
+        self.update_roi_label_adjustments()
 
     def handle_roi_label_contrast(self, value) -> None:
         maximum_contrast = self.ui.roi_frame_contrast_slider.maximum()
         contrast = int((1 + value / maximum_contrast  - 0.5) * 100)
         self.ui.roi_contrast_value_label.setText(f"{contrast}%")
+        self.update_roi_label_adjustments()
+
+    def update_roi_label_adjustments(self) -> None:
+        # The ROI label is rendered on the view thread, which must not read the sliders
+        brightness = self.ui.roi_frame_brightness_slider.value() / self.ui.roi_frame_brightness_slider.maximum()
+        contrast = 1 + self.ui.roi_frame_contrast_slider.value() / self.ui.roi_frame_contrast_slider.maximum() - 0.5
+        self.roi_label_lut = get_brightness_contrast_lut(brightness, contrast)
 
     def enable_tracking(self, roi) -> None:
         if not self.viewer.is_playing:
@@ -337,55 +471,122 @@ class Widget(QWidget):
         if self.ui.transmitter_check_box.isChecked() and not self.is_app_closing:
             self.socket_handler.send(Command.STOP_TRANSMISSION)
 
-    def update_view_label(self, frame: np.ndarray) -> None:
-        pixmap = numpy_to_pixmap(frame)
-        size = self.ui.view_label.size()
-        scaled_pixmap = scale_pixmap(pixmap, size)
-        self.ui.view_label.setPixmap(scaled_pixmap)
+    def render_frame(self, frame: StreamFrame) -> RenderedFrame:
+        self.roi_handler.prepare_frame(frame.receive_time)
+        results = self.render_graph.process(frame)
+        roi_image, roi_crop_failed = results.get(ROI_NODE, (None, False))
+        return RenderedFrame(frame, results.get(VIEW_NODE), roi_image, roi_crop_failed)
+
+    def log_roi_estimation_summary(self) -> None:
+        for summary in (self.roi_handler.get_prediction_summary(), self.roi_handler.get_local_tracker_summary()):
+            if summary is not None:
+                self.debug.send(summary)
+
+    def enable_local_tracking(self) -> None:
+        self.roi_handler.enable_local_tracking(True)
+        self.render_graph.enable_node(LOCAL_TRACKER_NODE)
+
+    def update_render_metrics(self, frame: StreamFrame) -> None:
+        now = time.perf_counter()
+        if self.last_render_time is not None and now > self.last_render_time:
+            fps = 1.0 / (now - self.last_render_time)
+            self.render_fps = fps if self.rendered_frames_count <= 1 else \
+                self.render_fps + (fps - self.render_fps) * RENDER_FPS_SMOOTHING
+        self.last_render_time = now
+        self.rendered_frames_count += 1
+
+    def start_recording(self, path: str) -> None:
+        self.recorder = FrameRecorder(path, int(self.ui.stream_fps_line_edit.text()))
+        self.render_graph.enable_node(RECORDER_NODE)
+
+    def record_frame(self, frame: np.ndarray) -> None:
+        if self.recorder is not None:
+            self.recorder.write(frame)
+
+    def on_frame_ready(self) -> None:
+        rendered_frame = self.viewer.take_frame()
+        if rendered_frame is None:
+            return
+        roi_preview_active = self.is_roi_preview_active()
+        if roi_preview_active != self.roi_preview_active:
+            self.roi_preview_active = roi_preview_active
+            self.update_stream_output_size()
+        if rendered_frame.view_image is not None:
+            self.update_view_label(rendered_frame.view_image)
+            self.viewer.record_frame_displayed(rendered_frame)
+        self.update_roi_label(rendered_frame)
+
+    def is_roi_preview_active(self) -> bool:
+        state = self.roi_handler.current_state
+        return state == ROIState.FAST_SELECTING or state == ROIState.TRACKING
 
-    def draw_crosshair(self, frame: np.ndarray)-> np.ndarray:
+    def update_stream_output_size(self) -> None:
+        if not self.stream_receiver.scale_to_view:
+            return
+        if self.roi_preview_active:
+            self.stream_receiver.set_output_size(None)
+            return
         stream_size = self.stream_receiver.get_stream_size()
-        center_x = stream_size[0] // 2
-        center_y = stream_size[1] // 2
-        length = 8
-        thickness = 2
-        frame = frame.copy()
-        cv2.line(frame, (center_x, center_y - length), (center_x, center_y + length), (0, 0, 255), thickness)
-        cv2.line(frame, (center_x - length, center_y), (center_x + length, center_y), (0, 0, 255), thickness)
-        return frame
-
-    def draw_crosshair_wrapper(self, func):
-        def wrapper(*args, **kwargs):
-            args = list(args)
-            if isinstance(args[0], np.ndarray):
-                args[0] = self.draw_crosshair(args[0])
-            return func(*args, **kwargs)
-        return wrapper
-
-
-    def update_roi_label(self, frame: np.ndarray) -> None:
+        if stream_size[0] == 0 or stream_size[1] == 0:
+            return
+        label_size = self.ui.view_label.size()
+        self.stream_receiver.set_output_size(fit_size(stream_size, (label_size.width(), label_size.height())))
+
+    def resizeEvent(self, event) -> None:
+        super().resizeEvent(event)
+        self.update_label_sizes()
+        if self.stream_receiver.scale_to_view:
+            self.output_size_timer.start()
+
+    def update_label_sizes(self) -> None:
+        # Copies of the label sizes for the view thread, widgets may only be read on the GUI thread
+        self.view_label_size = QSize(self.ui.view_label.size())
+        self.roi_label_size = QSize(self.ui.roi_label.size())
+
+    def convert_view_frame(self, frame: StreamFrame) -> np.ndarray:
+        size = get_frame_size(frame.data, frame.pix_fmt)
+        label_size = self.view_label_size
+        return frame_to_rgb(frame.data, frame.pix_fmt, fit_size(size, (label_size.width(), label_size.height())))
+
+    def convert_view_image(self, frame: np.ndarray) -> QImage:
+        return numpy_to_scaled_image(frame, self.view_label_size)
+
+    def paint_crosshair(self, image: QImage) -> QImage:
+        return paint_crosshair(image)
+
+    def update_view_label(self, image: QImage) -> None:
+        self.ui.view_label.setPixmap(QPixmap.fromImage(image))
+
+    def render_roi_label(self, frame: StreamFrame) -> tuple[QImage | None, bool]:
+        """
+        Renders the ROI magnifier image on the view thread
+        :return tuple[QImage | None, bool]: the image or None when there is no ROI preview,
+        and whether the fast ROI crop fell outside the frame
+        """
         state = self.roi_handler.current_state
         if state != ROIState.FAST_SELECTING and state != ROIState.TRACKING:
-            self.ui.roi_label.clear()
-            return
-        x, y = self.roi_handler.roi[0], self.roi_handler.roi[1]
-        w, h = self.roi_handler.roi[2], self.roi_handler.roi[3]
-        current_brightness_value = self.ui.roi_frame_brightness_slider.value()
-        maximum_brightness = self.ui.roi_frame_brightness_slider.maximum()
-        brightness = current_brightness_value / maximum_brightness
-
-        current_contrast_value = self.ui.roi_frame_contrast_slider.value()
-        maximum_contrast = self.ui.roi_frame_contrast_slider.maximum()
-        contrast = 1 + current_contrast_value / maximum_contrast  - 0.5
-
-        template = np.array(frame[y:y+h, x:x+w, :], order='C')
+            return None, False
+        x, y, w, h = self.roi_handler.get_frame_roi()
+        scale = self.roi_handler.get_frame_scale(frame.data)
+        if scale != 1.0:
+            x, y, w, h = int(x * scale), int(y * scale), max(1, int(w * scale)), max(1, int(h * scale))
+        template = crop_frame_to_rgb(frame.data, frame.pix_fmt, x, y, w, h)
         if template.shape != (h, w, 3) and state != ROIState.TRACKING :
+            return None, True
+        if template.size == 0:
+            return None, False
+        # The crop is a private array, the lookup is done in place
+        cv2.LUT(template, self.roi_label_lut, dst=template)
+        return numpy_to_scaled_image(template, self.roi_label_size), False
+
+    def update_roi_label(self, rendered_frame: RenderedFrame) -> None:
+        if rendered_frame.roi_crop_failed:
             self.roi_handler.reset_fast_roi()
             return
-        template = contrast * (template.astype(np.float32) / 255.0) + brightness
-        template = np.clip(template * 255.0, 0, 255).astype(np.uint8)
-        pixmap = numpy_to_pixmap(template)
-        self.ui.roi_label.setPixmap(scale_pixmap(pixmap, self.ui.roi_label.size()))
+        if rendered_frame.roi_image is None:
+            self.ui.roi_label.clear()
+            return
+        self.ui.roi_label.setPixmap(QPixmap.fromImage(rendered_frame.roi_image))
 
 
     def update_gui_on_play(self) -> None:
@@ -598,6 +799,10 @@ class Widget(QWidget):
         self.is_app_closing = True
         self.save_parameters()
         self.viewer.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.roi_handler.local_tracker is not None:
+            self.roi_handler.local_tracker.stop()
         self.zeroconf_handler.clear()
         self.save_thread.join(timeout=SAVE_TIMEOUT)
         if self.save_thread and self.save_thread.is_alive():
@@ -714,8 +919,52 @@ class KeyPressFilter(QObject):
             return True
         return super().eventFilter(obj, event)
 
+def parse_frame_size(value: str) -> tuple[int, int]:
+    """
+    Parses a WIDTHxHEIGHT frame size argument
+    :param value: e.g. 960x720
+    :return tuple[int, int]: width and height
+    """
+    parts = value.lower().split("x")
+    if len(parts) != 2 or not all(part.isdigit() and int(part) > 0 for part in parts):
+        raise argparse.ArgumentTypeError(f"invalid frame size '{value}', expected WIDTHxHEIGHT, e.g. 960x720")
+    return int(parts[0]), int(parts[1])
+
+def parse_arguments(argv) -> tuple[argparse.Namespace, list[str]]:
+    parser = argparse.ArgumentParser(description="Stream receiver")
+    parser.add_argument("--source", choices=["file", "synthetic"],
+                        help="play a recorded file or generated frames instead of the Pi stream")
+    parser.add_argument("--file", help="video file played by the file source")
+    parser.add_argument("--max-speed", action="store_true", help="play the offline source as fast as possible")
+    parser.add_argument("--size", type=parse_frame_size, default=f"{SYNTHETIC_FRAME_SIZE[0]}x{SYNTHETIC_FRAME_SIZE[1]}",
+                        help="frame size of the synthetic source, WIDTHxHEIGHT")
+    parser.add_argument("--roi-prediction", action="store_true",
+                        help="extrapolate the tracked ROI to the time of every displayed frame")
+    parser.add_argument("--roi-prediction-delay", type=float, default=0.0, metavar="SECONDS",
+                        help="time between the server capturing a frame and its ROI being received")
+    parser.add_argument("--roi-trail", action="store_true",
+                        help="draw the path of the tracked ROI over the last seconds")
+    parser.add_argument("--local-tracker", action="store_true",
+                        help="follow the ROI with template matching on the client while the server updates stall")
+    parser.add_argument("--record", metavar="PATH", help="record the displayed frames to a video file")
+    parser.add_argument("--pipeline-timing", action="store_true",
+                        help="collect the duration of every view pipeline stage and dump it to the log periodically")
+    parser.add_argument(STARTUP_TRACE_OPTION, action="store_true",
+                        help="log the time spent on every import and init phase once the window is shown")
+    return parser.parse_known_args(argv[1:])
+
+def create_offline_source(args: argparse.Namespace) -> FrameSource | None:
+    if args.source == "file":
+        if not args.file:
+            raise SystemExit("--source file needs --file")
+        return FileFrameSource(args.file, realtime=not args.max_speed)
+    if args.source == "synthetic":
+        return SyntheticFrameSource(args.size, realtime=not args.max_speed)
+    return None
+
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    args, qt_args = parse_arguments(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
 
     app_icon = QIcon()
     app_icon.addFile('gui/icons/16x16.png', QtCore.QSize(16, 16))
@@ -725,6 +974,19 @@ if __name__ == "__main__":
     app_icon.addFile('gui/icons/256x256.png', QtCore.QSize(256, 256))
     app.setWindowIcon(app_icon)
 
-    widget = Widget()
+    widget = Widget(startup_timer=StartupTimer(STARTUP_TIME, import_tracer))
+    offline_source = create_offline_source(args)
+    if offline_source is not None:
+        widget.use_offline_source(offline_source)
+    if args.record:
+        widget.start_recording(args.record)
+    if args.roi_trail:
+        widget.view_label_pipeline.enable_operation(widget.roi_handler.paint_trail.__name__)
+    if args.local_tracker:
+        widget.enable_local_tracking()
+    if args.roi_prediction:
+        widget.roi_handler.enable_prediction(True, args.roi_prediction_delay)
+    if args.pipeline_timing:
+        widget.render_graph.enable_timing()
     widget.show()
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,171 @@
+﻿import threading
+import time
+
+import numpy as np
+
+from src.tools import DebugEmitter, get_frame_shape, PIX_FMT_RGB24, PIX_FMT_YUV420P
+from src.frame_buffer import FrameRingBuffer, StreamFrame
+
+# PyAV is optional, the receiver falls back to the ffmpeg subprocess when it is not installed.
+# It is imported on first use since loading libav slows down the application startup
+av = None
+_av_import_attempted = False
+
+OPEN_TIMEOUT = 5
+READ_TIMEOUT = 2
+
+DECODE_TIME_SMOOTHING = 0.1
+
+
+class AVDecoder:
+    """
+    In-process stream decoder built on PyAV (libav bindings).
+    Publishes frames into the receiver's frame buffer as views of the decoder's own frame buffers.
+    """
+
+    def __init__(self, frame_buffer: FrameRingBuffer, options: dict, pix_fmt=PIX_FMT_RGB24, size_callback=None):
+        self.frame_buffer = frame_buffer
+        self.size_callback = size_callback
+        self.options = options
+        self.pix_fmt = pix_fmt
+        self.output_size = None
+        self.decode_thread = None
+        self.last_decode_time = 0.0
+        self.average_decode_time = 0.0
+        self.decoded_frames_count = 0
+        self.debug = DebugEmitter()
+        self._stop_event = threading.Event()
+
+
+    @staticmethod
+    def is_available() -> bool:
+        global av, _av_import_attempted
+        if not _av_import_attempted:
+            _av_import_attempted = True
+            try:
+                import av
+            except ImportError:
+                av = None
+        return av is not None
+
+
+    def start(self, url: str) -> None:
+        """
+        Starts decoding the stream on given url
+        :param url:
+        :return None:
+        """
+        self._stop_event.clear()
+        self.decode_thread = threading.Thread(target=self.decode_stream, args=(url,), daemon=True)
+        self.decode_thread.start()
+
+
+    def stop(self) -> None:
+        """
+        Asks the decode thread to stop, it exits after the current frame or read timeout
+        without publishing anything else
+        :return None:
+        """
+        self._stop_event.set()
+
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Waits for the decode thread to exit
+        :param timeout: seconds to wait
+        :return bool: True if the thread is not running
+        """
+        decode_thread = self.decode_thread
+        if decode_thread is None or decode_thread is threading.current_thread():
+            return True
+        decode_thread.join(timeout)
+        return not decode_thread.is_alive()
+
+
+    def decode_stream(self, url: str) -> None:
+        """
+        Decodes the stream publishing every frame with its decode time
+        :param url:
+        :return None:
+        """
+        try:
+            with av.open(url, options=self.options, timeout=(OPEN_TIMEOUT, READ_TIMEOUT)) as container:
+                stream = container.streams.video[0]
+                self.debug.send(f"PyAV decoder opened {stream.codec_context.name} {stream.width}x{stream.height}")
+                frames = container.decode(stream)
+                decoded_size = None
+                while not self._stop_event.is_set():
+                    start_time = time.perf_counter()
+                    frame = next(frames, None)
+                    if frame is None:
+                        self.debug.send("PyAV decoder reached the end of the stream")
+                        break
+                    # stop() may have been called while next() was blocked reading, the frame belongs to the old stream
+                    if self._stop_event.is_set():
+                        break
+                    if (frame.width, frame.height) != decoded_size:
+                        decoded_size = (frame.width, frame.height)
+                        if self.size_callback is not None:
+                            self.size_callback(decoded_size)
+                    pts = frame.time
+                    data = self.frame_to_ndarray(frame)
+                    self.update_decode_time(time.perf_counter() - start_time)
+                    if self._stop_event.is_set():
+                        break
+                    self.frame_buffer.publish(StreamFrame(data, pix_fmt=self.pix_fmt, pts=pts))
+        except Exception as e:
+            self.debug.send(f"PyAV decoder stopped due to an error: {e}")
+        self.debug.send(f"PyAV decoder stopped, average decode time {self.average_decode_time * 1000:.2f} ms")
+
+
+    def frame_to_ndarray(self, frame) -> np.ndarray:
+        """
+        Wraps the frame plane into a numpy array without copying it when the rows are not padded.
+        The frame is scaled to the output size first if it is set.
+        Planar yuv420p is packed into one array, which needs a copy
+        :param frame: av.VideoFrame
+        :return np.ndarray:
+        """
+        output_size = self.output_size
+        if output_size is not None and output_size != (frame.width, frame.height):
+            frame = frame.reformat(width=output_size[0], height=output_size[1], format=self.pix_fmt)
+        elif frame.format.name != self.pix_fmt:
+            frame = frame.reformat(format=self.pix_fmt)
+        width, height = frame.width, frame.height
+        if self.pix_fmt == PIX_FMT_YUV420P:
+            data = np.empty(get_frame_shape(width, height, self.pix_fmt), dtype=np.uint8)
+            flat = data.reshape(-1)
+            offset = 0
+            for plane, (plane_width, plane_height) in zip(
+                    frame.planes, ((width, height), (width // 2, height // 2), (width // 2, height // 2))):
+                flat[offset:offset + plane_width * plane_height].reshape(plane_height, plane_width)[...] = \
+                    self.plane_rows(plane, plane_width, plane_height)
+                offset += plane_width * plane_height
+            return data
+
+        shape = get_frame_shape(width, height, self.pix_fmt)
+        row_size = width * (shape[2] if len(shape) == 3 else 1)
+        plane = frame.planes[0]
+        data = self.plane_rows(plane, row_size, height)
+        if plane.line_size != row_size:
+            data = np.ascontiguousarray(data)
+        return data.reshape(shape)
+
+
+    @staticmethod
+    def plane_rows(plane, row_size, height) -> np.ndarray:
+        """
+        Gets a view of the plane rows without the line padding
+        :return np.ndarray:
+        """
+        data = np.frombuffer(plane, dtype=np.uint8)[:plane.line_size * height]
+        return data.reshape(height, plane.line_size)[:, :row_size]
+
+
+    def update_decode_time(self, decode_time: float) -> None:
+        self.last_decode_time = decode_time
+        if self.decoded_frames_count == 0:
+            self.average_decode_time = decode_time
+        else:
+            self.average_decode_time += (decode_time - self.average_decode_time) * DECODE_TIME_SMOOTHING
+        self.decoded_frames_count += 1
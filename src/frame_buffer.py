@@ -0,0 +1,173 @@
+﻿import threading
+import time
+
+import numpy as np
+
+from src.tools import PIX_FMT_RGB24
+
+DEFAULT_SLOT_COUNT = 4
+
+
+class StreamFrame:
+    """
+    A frame slot: raw image data, its pixel format, the sequence number it was published with,
+    the wall-clock time it was received at and the decoder PTS in seconds when it is known
+    """
+    __slots__ = ("data", "sequence", "pix_fmt", "receive_time", "pts")
+
+    def __init__(self, data: np.ndarray = None, sequence: int = 0, pix_fmt=PIX_FMT_RGB24, pts: float = None):
+        self.data = data
+        self.sequence = sequence
+        self.pix_fmt = pix_fmt
+        self.receive_time = 0.0
+        self.pts = pts
+
+
+class FrameRingBuffer:
+    """
+    Preallocated ring of writable frame slots.
+    The writer fills the next slot in place and publishes it, readers get a reference to the latest
+    published slot. A slot is written again only after slot_count - 1 newer frames have been published,
+    so a reader has to be done with a frame (or copy it) within that window.
+    """
+
+    def __init__(self, slot_count=DEFAULT_SLOT_COUNT):
+        if slot_count < 2:
+            raise ValueError(f"Frame ring buffer needs at least 2 slots, got {slot_count}")
+        self.slot_count = slot_count
+        self.shape = None
+        self.pix_fmt = None
+        self.slots = []
+        self.write_index = 0
+        self.sequence = 0
+        self.latest = None
+        self.last_publish_time = 0.0
+        self._lock = threading.Lock()
+        self._frame_published = threading.Condition(self._lock)
+
+
+    def configure(self, shape, pix_fmt=PIX_FMT_RGB24) -> bool:
+        """
+        Allocates the slots for the given frame shape, does nothing if the shape and format are unchanged
+        :param shape: numpy shape of a single frame
+        :param pix_fmt: pixel format of the frames
+        :return bool: True if the slots were reallocated
+        """
+        shape = tuple(shape)
+        if shape == self.shape and pix_fmt == self.pix_fmt:
+            return False
+        with self._lock:
+            self.shape = shape
+            self.pix_fmt = pix_fmt
+            self.slots = [StreamFrame(np.empty(shape, dtype=np.uint8), pix_fmt=pix_fmt) for _ in range(self.slot_count)]
+            self.write_index = 0
+        return True
+
+
+    def next_slot(self) -> StreamFrame:
+        """
+        Gets the slot the writer should fill next. It is never the latest published slot
+        :return StreamFrame:
+        """
+        return self.slots[self.write_index]
+
+
+    def publish(self, slot: StreamFrame) -> int:
+        """
+        Makes the filled slot the latest frame and stamps it with the receive time
+        :param slot: slot returned by next_slot or a frame owned by the writer
+        :return int: sequence number of the published frame
+        """
+        receive_time = time.time()
+        with self._lock:
+            slot.receive_time = receive_time
+            self.sequence += 1
+            slot.sequence = self.sequence
+            self.latest = slot
+            self.last_publish_time = time.monotonic()
+            if self.slots and slot is self.slots[self.write_index]:
+                self.write_index = (self.write_index + 1) % self.slot_count
+            self._frame_published.notify_all()
+            return self.sequence
+
+
+    def get_latest(self) -> StreamFrame | None:
+        """
+        Gets the latest published slot
+        :return StreamFrame | None:
+        """
+        with self._lock:
+            return self.latest
+
+
+    def wait_for_frame(self, last_sequence: int, timeout: float = None) -> StreamFrame | None:
+        """
+        Blocks until a frame newer than last_sequence is published
+        :param last_sequence: sequence number of the last frame the reader has handled
+        :param timeout: seconds to wait, None waits forever
+        :return StreamFrame | None: the latest slot or None on timeout
+        """
+        with self._frame_published:
+            if not self._frame_published.wait_for(
+                    lambda: self.latest is not None and self.sequence > last_sequence, timeout):
+                return None
+            return self.latest
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self.latest = None
+
+
+class FrameMailbox:
+    """
+    Single-slot hand-off between a producer thread and the GUI thread where the latest frame wins.
+    The producer notifies the consumer only when the mailbox was empty, so at most one notification
+    is ever queued and frames the consumer had no time for are dropped instead of piling up.
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._lock = threading.Lock()
+        self.dropped_count = 0
+
+
+    def post(self, frame) -> bool:
+        """
+        Puts the frame into the mailbox replacing the one that was not taken yet
+        :param frame:
+        :return bool: True if the mailbox was empty and the consumer has to be notified
+        """
+        with self._lock:
+            was_empty = self._frame is None
+            if not was_empty:
+                self.dropped_count += 1
+            self._frame = frame
+            return was_empty
+
+
+    def take(self):
+        """
+        Takes the latest frame out of the mailbox
+        :return: the frame or None if the mailbox is empty
+        """
+        with self._lock:
+            frame = self._frame
+            self._frame = None
+            return frame
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frame = None
+
+
+    def reset_dropped_count(self) -> int:
+        """
+        Resets the dropped frames counter
+        :return int: number of frames dropped since the last reset
+        """
+        with self._lock:
+            dropped_count = self.dropped_count
+            self.dropped_count = 0
+            return dropped_count
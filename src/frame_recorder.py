@@ -0,0 +1,63 @@
+﻿import threading
+
+import cv2
+import numpy as np
+
+from src.tools import DebugEmitter
+
+RECORDER_FOURCC = "mp4v"
+DEFAULT_RECORDING_FRAME_RATE = 30
+
+
+class FrameRecorder:
+    """
+    Writes rgb24 frames to a video file. The writer is opened with the size of the first frame,
+    frames of another size are resized to it
+    """
+
+    def __init__(self, path, frame_rate=DEFAULT_RECORDING_FRAME_RATE):
+        self.path = str(path)
+        self.frame_rate = frame_rate
+        self.writer = None
+        self.frame_size = None
+        self.recorded_frames_count = 0
+        self.debug = DebugEmitter()
+        self._bgr_frame = None
+        self._lock = threading.Lock()
+
+
+    def write(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Appends the frame to the video, the frame is not modified
+        :param frame: rgb24 frame
+        :return np.ndarray: the same frame
+        """
+        with self._lock:
+            if self.writer is None and not self.open((frame.shape[1], frame.shape[0])):
+                return frame
+            if (frame.shape[1], frame.shape[0]) != self.frame_size:
+                frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_NEAREST)
+            cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=self._bgr_frame)
+            self.writer.write(self._bgr_frame)
+            self.recorded_frames_count += 1
+        return frame
+
+
+    def open(self, frame_size) -> bool:
+        self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*RECORDER_FOURCC), self.frame_rate, frame_size)
+        if not self.writer.isOpened():
+            self.debug.send(f"Can not open video file for recording: {self.path}")
+            self.writer = None
+            return False
+        self.frame_size = frame_size
+        self._bgr_frame = np.empty((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+        self.debug.send(f"Recording {frame_size[0]}x{frame_size[1]} frames to {self.path}")
+        return True
+
+
+    def close(self) -> None:
+        with self._lock:
+            if self.writer is not None:
+                self.writer.release()
+                self.writer = None
+                self.debug.send(f"Recorded {self.recorded_frames_count} frames to {self.path}")
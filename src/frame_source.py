@@ -0,0 +1,407 @@
+﻿import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.tools import DebugEmitter
+from src.frame_buffer import FrameRingBuffer, StreamFrame
+from src.stream_receiver import StreamReceiver, FRAME_SLOT_COUNT, FRAME_WAIT_TIMEOUT
+
+DEFAULT_FRAME_RATE = 60
+STOP_TIMEOUT = 1
+CAMERA_OPEN_TIMEOUT = 10
+
+SYNTHETIC_FRAME_SIZE = (960, 720)
+SYNTHETIC_TARGET_SIZE = 48
+SYNTHETIC_TARGET_COLOR = (255, 255, 255)
+SYNTHETIC_NOISE_SEED = 0
+
+
+class FrameSource(ABC):
+    """
+    Base class of the frame sources the viewer plays.
+    A source publishes frames with increasing sequence numbers, consumers block in wait_for_frame until a new one arrives
+    """
+
+    name = "source"
+
+    @abstractmethod
+    def start(self) -> None:
+        ...
+
+
+    @abstractmethod
+    def stop(self) -> None:
+        ...
+
+
+    def get_frame_sequence(self) -> int:
+        """
+        Gets the sequence number of the latest frame, frames up to it are not delivered after start
+        :return int:
+        """
+        return 0
+
+
+    @abstractmethod
+    def wait_for_frame(self, last_sequence: int, timeout: float = FRAME_WAIT_TIMEOUT) -> StreamFrame | None:
+        """
+        Waits until a frame newer than last_sequence is available
+        :param last_sequence: sequence number of the last handled frame
+        :param timeout: seconds to wait
+        :return StreamFrame | None: the new frame or None on timeout
+        """
+
+
+    def get_frame_size(self) -> tuple[int, int] | None:
+        """
+        Gets the size of the frames in stream coordinates if the source defines it
+        :return tuple[int, int] | None:
+        """
+        return None
+
+
+class StreamFrameSource(FrameSource):
+    """
+    The Pi stream received by StreamReceiver
+    """
+
+    name = "stream"
+
+    def __init__(self, stream_receiver: StreamReceiver):
+        self.stream_receiver = stream_receiver
+        self.url = None
+
+
+    def set_url(self, url: str) -> None:
+        self.url = url
+
+
+    def start(self) -> None:
+        self.stream_receiver.start(self.url)
+
+
+    def stop(self) -> None:
+        self.stream_receiver.stop()
+
+
+    def get_frame_sequence(self) -> int:
+        return self.stream_receiver.get_frame_sequence()
+
+
+    def wait_for_frame(self, last_sequence: int, timeout: float = FRAME_WAIT_TIMEOUT) -> StreamFrame | None:
+        return self.stream_receiver.wait_for_frame(last_sequence, timeout)
+
+
+class ThreadedFrameSource(FrameSource):
+    """
+    Base class of the sources that produce frames on their own thread into a frame ring buffer,
+    either paced at the frame rate (real time) or as fast as possible
+    """
+
+    def __init__(self, frame_rate=DEFAULT_FRAME_RATE, realtime=True):
+        self.frame_rate = frame_rate
+        self.realtime = realtime
+        self.frame_buffer = FrameRingBuffer(FRAME_SLOT_COUNT)
+        self.frame_index = 0
+        self.thread = None
+        self.debug = DebugEmitter()
+        self._stop_event = threading.Event()
+
+
+    @abstractmethod
+    def open(self) -> bool:
+        """
+        Prepares the source and configures the frame buffer
+        :return bool: False if the source can not be played
+        """
+
+
+    @abstractmethod
+    def read_into(self, slot: StreamFrame) -> bool:
+        """
+        Fills the slot with the next frame
+        :param slot:
+        :return bool: False when there are no more frames
+        """
+
+
+    def close(self) -> None:
+        return
+
+
+    def start(self) -> None:
+        self.stop()
+        if not self.open():
+            self.debug.send(f"Frame source '{self.name}' can not be opened")
+            return
+        self.frame_index = 0
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=STOP_TIMEOUT)
+        self.thread = None
+
+
+    def run(self) -> None:
+        """
+        Produces frames until stopped or the source ends
+        :return None:
+        """
+        frame_time = 1.0 / self.frame_rate
+        next_frame_time = time.perf_counter()
+        try:
+            while not self._stop_event.is_set():
+                slot = self.frame_buffer.next_slot()
+                if not self.read_into(slot):
+                    self.debug.send(f"Frame source '{self.name}' ended")
+                    break
+                if self.realtime:
+                    delay = next_frame_time - time.perf_counter()
+                    if delay > 0:
+                        self._stop_event.wait(delay)
+                        next_frame_time += frame_time
+                    else:
+                        next_frame_time = time.perf_counter() + frame_time
+                self.frame_index += 1
+                self.frame_buffer.publish(slot)
+        except Exception as e:
+            self.debug.send(f"Frame source '{self.name}' stopped due to an error: {e}")
+        finally:
+            self.close()
+
+
+    def get_frame_sequence(self) -> int:
+        return self.frame_buffer.sequence
+
+
+    def wait_for_frame(self, last_sequence: int, timeout: float = FRAME_WAIT_TIMEOUT) -> StreamFrame | None:
+        return self.frame_buffer.wait_for_frame(last_sequence, timeout)
+
+
+    def get_frame_size(self) -> tuple[int, int] | None:
+        if self.frame_buffer.shape is None:
+            return None
+        return self.frame_buffer.shape[1], self.frame_buffer.shape[0]
+
+
+class FileFrameSource(ThreadedFrameSource):
+    """
+    A recorded video file played in real time or at maximum speed, looped when it ends
+    """
+
+    name = "file"
+
+    def __init__(self, path, realtime=True, loop=True):
+        super().__init__(DEFAULT_FRAME_RATE, realtime)
+        self.path = Path(path)
+        self.loop = loop
+        self.capture = None
+        self._bgr_frame = None
+
+
+    def open(self) -> bool:
+        self.capture = cv2.VideoCapture(str(self.path))
+        if not self.capture.isOpened():
+            self.capture = None
+            return False
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.frame_rate = fps if fps >= 1 else DEFAULT_FRAME_RATE
+        width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frame_buffer.configure((height, width, 3))
+        self._bgr_frame = np.empty((height, width, 3), dtype=np.uint8)
+        return True
+
+
+    def read_into(self, slot: StreamFrame) -> bool:
+        ok, frame = self.capture.read(self._bgr_frame)
+        if not ok and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read(self._bgr_frame)
+        if not ok:
+            return False
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=slot.data)
+        slot.pts = self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        return True
+
+
+    def close(self) -> None:
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+class SyntheticFrameSource(ThreadedFrameSource):
+    """
+    Generated frames with a bright square target moving on a Lissajous path over a static textured background
+    """
+
+    name = "synthetic"
+
+    def __init__(self, size=SYNTHETIC_FRAME_SIZE, frame_rate=DEFAULT_FRAME_RATE, realtime=True):
+        super().__init__(frame_rate, realtime)
+        self.size = size
+        self.background = None
+
+
+    def open(self) -> bool:
+        width, height = self.size
+        self.frame_buffer.configure((height, width, 3))
+        if self.background is None or self.background.shape[:2] != (height, width):
+            rng = np.random.default_rng(SYNTHETIC_NOISE_SEED)
+            gradient = np.linspace(40, 120, width, dtype=np.float32)[None, :, None]
+            noise = rng.integers(0, 40, (height, width, 1), dtype=np.uint8)
+            self.background = np.ascontiguousarray(
+                np.broadcast_to(gradient + noise, (height, width, 3)).astype(np.uint8))
+        return True
+
+
+    def get_target_position(self, t: float) -> tuple[int, int]:
+        """
+        Gets the top left corner of the target at time t
+        :param t: seconds since start
+        :return tuple[int, int]:
+        """
+        width, height = self.size
+        amplitude_x = (width - SYNTHETIC_TARGET_SIZE) / 2
+        amplitude_y = (height - SYNTHETIC_TARGET_SIZE) / 2
+        x = amplitude_x + amplitude_x * np.sin(2 * np.pi * 0.13 * t)
+        y = amplitude_y + amplitude_y * np.sin(2 * np.pi * 0.21 * t + 0.5)
+        return int(x), int(y)
+
+
+    def read_into(self, slot: StreamFrame) -> bool:
+        t = self.frame_index / self.frame_rate
+        np.copyto(slot.data, self.background)
+        x, y = self.get_target_position(t)
+        slot.data[y:y + SYNTHETIC_TARGET_SIZE, x:x + SYNTHETIC_TARGET_SIZE] = SYNTHETIC_TARGET_COLOR
+        slot.pts = t
+        return True
+
+
+class CameraFrameSource(ThreadedFrameSource):
+    """
+    The system camera grabbed continuously on the source thread.
+    Frames are resized to the tracking frame size and converted to RGB into preallocated buffers,
+    the viewer always gets the newest one. Black frames are produced at the frame rate while the camera
+    is still opening or when there is no camera.
+    The camera is opened lazily on a background thread, probing it can take seconds
+    """
+
+    name = "camera"
+
+    def __init__(self, frame_rate=DEFAULT_FRAME_RATE, camera_index=0):
+        super().__init__(frame_rate, realtime=False)
+        self.camera_index = camera_index
+        self.frame_size = (0, 0)
+        self.system_camera = None
+        self.camera_open_time = None
+        self.open_thread = None
+        self._bgr_frame = None
+        self._resized_frame = None
+        self._camera_ready = threading.Event()
+        self._open_lock = threading.Lock()
+
+
+    def request_camera(self) -> None:
+        """
+        Starts opening the camera on a background thread unless it was already requested
+        :return None:
+        """
+        with self._open_lock:
+            if self.open_thread is not None:
+                return
+            self.open_thread = threading.Thread(target=self.open_camera, daemon=True)
+            self.open_thread.start()
+
+
+    def open_camera(self) -> None:
+        start_time = time.perf_counter()
+        try:
+            system_camera = cv2.VideoCapture(self.camera_index)
+            if system_camera.isOpened() and system_camera.get(cv2.CAP_PROP_FPS) < 1:
+                raise Exception("System camera is not working")
+            self.system_camera = system_camera
+        except Exception as e:
+            self.debug.send(f"Error initializing system camera: {e}")
+            self.system_camera = None
+        self.camera_open_time = time.perf_counter() - start_time
+        self.debug.send(f"System camera opened in {self.camera_open_time:.2f} s")
+        self._camera_ready.set()
+
+
+    def set_frame_rate(self, frame_rate) -> None:
+        self.frame_rate = frame_rate
+
+
+    def set_frame_size(self, size) -> None:
+        """
+        Sets the size frames are resized to, it is applied on the next start
+        :param size: (width, height)
+        :return None:
+        """
+        self.frame_size = tuple(size)
+
+
+    def is_camera_available(self) -> bool:
+        return self._camera_ready.is_set() and self.system_camera is not None and self.system_camera.isOpened()
+
+
+    def open(self) -> bool:
+        self.request_camera()
+        frame_size = self.frame_size
+        if frame_size[0] == 0 or frame_size[1] == 0:
+            # Without a tracking frame size the camera size is used, which is known only once it is open
+            self._camera_ready.wait(CAMERA_OPEN_TIMEOUT)
+            if not self.is_camera_available():
+                return False
+            frame_size = (int(self.system_camera.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                          int(self.system_camera.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        if self.frame_buffer.configure((frame_size[1], frame_size[0], 3)):
+            self._resized_frame = None
+        return True
+
+
+    def read_into(self, slot: StreamFrame) -> bool:
+        slot.pts = None
+        if not self.is_camera_available():
+            self.read_black_frame(slot)
+            return True
+        ok, frame = self.system_camera.read(self._bgr_frame)
+        if not ok:
+            # Keep the old behaviour of showing a black frame when the camera does not deliver
+            self.read_black_frame(slot)
+            return True
+        self._bgr_frame = frame
+        if frame.shape[:2] != slot.data.shape[:2]:
+            if self._resized_frame is None:
+                self._resized_frame = np.empty(slot.data.shape, dtype=np.uint8)
+            cv2.resize(frame, (slot.data.shape[1], slot.data.shape[0]), self._resized_frame,
+                       interpolation=cv2.INTER_LINEAR)
+            frame = self._resized_frame
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=slot.data)
+        return True
+
+
+    def read_black_frame(self, slot: StreamFrame) -> None:
+        """
+        Fills the slot with black paced by the frame rate
+        :param slot:
+        :return None:
+        """
+        slot.data[...] = 0
+        self._stop_event.wait(1.0 / self.frame_rate)
+
+
+    def get_frame_size(self) -> tuple[int, int] | None:
+        # The tracking frame size comes from the server, the camera does not redefine it
+        return None
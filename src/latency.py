@@ -0,0 +1,176 @@
+﻿import bisect
+import threading
+
+import numpy as np
+
+from src.tools import PIX_FMT_RGB24
+
+# Bin edges in milliseconds: 0 and 64 log-spaced edges from 1 ms to 10 s
+LATENCY_BIN_EDGES = [0.0] + list(np.geomspace(1.0, 10000.0, 64))
+
+STAMP_BITS = 32
+STAMP_BLOCK_SIZE = 8
+STAMP_THRESHOLD = 128
+STAMP_MODULO = 1 << STAMP_BITS
+
+
+class LatencyHistogram:
+    """
+    Fixed-bin latency histogram, adding a sample does not allocate
+    """
+
+    def __init__(self, name: str, edges=LATENCY_BIN_EDGES, precision=1):
+        self.name = name
+        self.edges = edges
+        self.precision = precision
+        self.counts = np.zeros(len(edges), dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+
+    def add(self, latency: float) -> None:
+        """
+        Adds a sample
+        :param latency: latency in seconds
+        :return None:
+        """
+        latency_ms = max(0.0, latency * 1000.0)
+        self.counts[bisect.bisect_right(self.edges, latency_ms) - 1] += 1
+        self.count += 1
+        self.total += latency_ms
+        self.maximum = max(self.maximum, latency_ms)
+
+
+    def percentile(self, q: float) -> float:
+        """
+        Gets the upper bin edge the q-th percentile falls into
+        :param q: percentile from 0 to 100
+        :return float: latency in milliseconds
+        """
+        if self.count == 0:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.count))
+        if index + 1 < len(self.edges):
+            return min(self.edges[index + 1], self.maximum)
+        return self.maximum
+
+
+    def reset(self) -> None:
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+
+    def as_dict(self) -> dict:
+        """
+        Gets the statistics in milliseconds
+        :return dict:
+        """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.maximum
+        }
+
+
+    def summary(self) -> str:
+        if self.count == 0:
+            return f"{self.name}: no samples"
+        p = self.precision
+        return (f"{self.name}: n={self.count}, mean={self.total / self.count:.{p}f} ms, "
+                f"p50={self.percentile(50):.{p}f} ms, p95={self.percentile(95):.{p}f} ms, "
+                f"p99={self.percentile(99):.{p}f} ms, max={self.maximum:.{p}f} ms")
+
+
+def decode_frame_stamp(frame: np.ndarray, pix_fmt=PIX_FMT_RGB24) -> int | None:
+    """
+    Recovers the stamp the server draws into the top left corner of the frame:
+    STAMP_BITS black or white squares of STAMP_BLOCK_SIZE pixels, most significant bit first.
+    The server stamps its capture time in milliseconds modulo 2^32
+    :param frame: raw frame, for yuv420p and gray only the luma is read
+    :param pix_fmt: ffmpeg pixel format name
+    :return int | None: the stamp or None if the frame is too small
+    """
+    if frame is None or frame.shape[1] < STAMP_BITS * STAMP_BLOCK_SIZE or frame.shape[0] < STAMP_BLOCK_SIZE:
+        return None
+    center = STAMP_BLOCK_SIZE // 2
+    row = frame[center, center:STAMP_BITS * STAMP_BLOCK_SIZE:STAMP_BLOCK_SIZE]
+    if pix_fmt == PIX_FMT_RGB24:
+        row = row[:, 1]
+    stamp = 0
+    for value in row:
+        stamp = (stamp << 1) | int(value >= STAMP_THRESHOLD)
+    return stamp
+
+
+class FrameLatencyMonitor:
+    """
+    Collects receive to display, PTS to display and optionally end-to-end latency of displayed frames.
+    PTS to display is relative to the smallest offset seen, since the stream clock has an unknown origin.
+    End-to-end latency needs the server to stamp frames and both clocks to be synchronized
+    """
+
+    def __init__(self, stamp_enabled=False):
+        self.stamp_enabled = stamp_enabled
+        self.receive_to_display = LatencyHistogram("receive->display")
+        self.pts_to_display = LatencyHistogram("pts->display")
+        self.end_to_end = LatencyHistogram("end-to-end")
+        self._pts_offset = None
+        self._lock = threading.Lock()
+
+
+    def read_stamp(self, frame) -> int | None:
+        """
+        Reads the server stamp of the frame, must be called while the frame buffer still holds the frame
+        :param frame: StreamFrame
+        :return int | None: the stamp or None if stamps are disabled
+        """
+        if not self.stamp_enabled:
+            return None
+        return decode_frame_stamp(frame.data, frame.pix_fmt)
+
+
+    def record(self, receive_time: float, pts: float | None, stamp: int | None, display_time: float) -> None:
+        """
+        Records a displayed frame from values copied out of the frame before its buffer could be reused
+        :param receive_time: wall-clock time the frame was received at, 0 when unknown
+        :param pts: presentation timestamp of the frame in seconds or None
+        :param stamp: server stamp read with read_stamp or None
+        :param display_time: wall-clock time the frame was displayed at
+        :return None:
+        """
+        with self._lock:
+            if receive_time:
+                self.receive_to_display.add(display_time - receive_time)
+            if pts is not None:
+                offset = display_time - pts
+                if self._pts_offset is None or offset < self._pts_offset:
+                    self._pts_offset = offset
+                self.pts_to_display.add(offset - self._pts_offset)
+            if stamp is not None:
+                latency_ms = (int(display_time * 1000) - stamp) % STAMP_MODULO
+                if latency_ms < STAMP_MODULO // 2:
+                    self.end_to_end.add(latency_ms / 1000.0)
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self.receive_to_display.reset()
+            self.pts_to_display.reset()
+            self.end_to_end.reset()
+            self._pts_offset = None
+
+
+    def summary(self) -> str:
+        with self._lock:
+            lines = [self.receive_to_display.summary()]
+            if self.pts_to_display.count:
+                lines.append(self.pts_to_display.summary())
+            if self.stamp_enabled:
+                lines.append(self.end_to_end.summary())
+            return "\n".join(lines)
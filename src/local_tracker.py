@@ -0,0 +1,230 @@
+﻿import math
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from src.tools import DebugEmitter, crop_frame_to_gray, get_frame_size
+from src.frame_buffer import StreamFrame, FrameMailbox
+
+DEFAULT_STALL_TIMEOUT = 0.25
+SEARCH_MARGIN_RATIO = 0.75
+MIN_SEARCH_MARGIN = 8
+MIN_MATCH_SCORE = 0.5
+MIN_TEMPLATE_SIZE = 4
+WORKER_WAIT_TIMEOUT = 0.5
+
+
+class SearchRequest:
+    """
+    Grayscale crop around the last ROI handed from the render thread to the tracker thread
+    """
+    __slots__ = ("region", "origin", "scale", "timestamp", "is_template")
+
+    def __init__(self, region: np.ndarray, origin: tuple[int, int], scale: float, timestamp: float, is_template: bool):
+        self.region = region
+        self.origin = origin
+        self.scale = scale
+        self.timestamp = timestamp
+        self.is_template = is_template
+
+
+class LocalTracker:
+    """
+    Client-side fallback tracker following the target while the server ROI updates are stalled.
+    Every server ROI takes a new template from the next frame, when no update arrives for stall_timeout seconds
+    the template is matched in a window around the last ROI. Only the small crops are taken on the render thread,
+    the matching runs on a worker thread. When the server updates resume, the distance between the local
+    and the server ROI centers is reported as the divergence
+    """
+
+    def __init__(self, stall_timeout=DEFAULT_STALL_TIMEOUT, search_margin_ratio=SEARCH_MARGIN_RATIO,
+                 min_score=MIN_MATCH_SCORE):
+        self.stall_timeout = stall_timeout
+        self.search_margin_ratio = search_margin_ratio
+        self.min_score = min_score
+        self.debug = DebugEmitter()
+
+        self._lock = threading.Lock()
+        self._mailbox = FrameMailbox()
+        self._request_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self._template = None
+        self._template_pending = False
+        self._roi = None
+        self._server_time = 0.0
+        self._stall_start_time = None
+        self._is_following = False
+        self.last_score = 0.0
+        self.reset_divergence()
+
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._request_event.set()
+
+
+    def reset(self) -> None:
+        """
+        Forgets the template and the local ROI, called when tracking stops or starts again
+        :return None:
+        """
+        with self._lock:
+            self._template = None
+            self._template_pending = False
+            self._roi = None
+            self._stall_start_time = None
+            self._is_following = False
+        self._mailbox.clear()
+
+
+    def reset_divergence(self) -> None:
+        self.divergence_count = 0
+        self.divergence_total = 0.0
+        self.divergence_maximum = 0.0
+        self.last_divergence = 0.0
+        self.lost_count = 0
+
+
+    def resync(self, roi, timestamp: float) -> None:
+        """
+        Resynchronizes the tracker to a server ROI, a new template is taken from the next submitted frame
+        :param roi: [x, y, width, height] in stream coordinates
+        :param timestamp: wall-clock time the ROI was received at
+        :return None:
+        """
+        with self._lock:
+            if self._is_following and self._roi is not None:
+                divergence = math.hypot(self._roi[0] + self._roi[2] / 2 - (roi[0] + roi[2] / 2),
+                                        self._roi[1] + self._roi[3] / 2 - (roi[1] + roi[3] / 2))
+                stall_duration = timestamp - self._stall_start_time if self._stall_start_time else 0.0
+                self.divergence_count += 1
+                self.divergence_total += divergence
+                self.divergence_maximum = max(self.divergence_maximum, divergence)
+                self.last_divergence = divergence
+                self.debug.send(f"Local tracker followed the ROI for {stall_duration:.2f} s, "
+                                f"divergence from the server {divergence:.1f} px")
+            self._roi = [float(v) for v in roi]
+            self._server_time = timestamp
+            self._stall_start_time = None
+            self._is_following = False
+            self._template_pending = True
+
+
+    def is_stalled(self, now: float) -> bool:
+        return self._roi is not None and now - self._server_time > self.stall_timeout
+
+
+    def submit(self, frame: StreamFrame, scale: float) -> None:
+        """
+        Crops the template or the search window from the frame and hands it to the worker thread.
+        Must be called from the render thread, frames are not kept since their buffers are reused
+        :param frame: rendered frame
+        :param scale: scale from stream coordinates to the frame
+        :return None:
+        """
+        timestamp = frame.receive_time if frame.receive_time else time.time()
+        with self._lock:
+            if self._roi is None:
+                return
+            x, y, w, h = self._roi
+            is_template = self._template_pending
+            if not is_template and (self._template is None or not self.is_stalled(timestamp)):
+                return
+            self._template_pending = False
+        x, y, w, h = int(x * scale), int(y * scale), max(1, int(w * scale)), max(1, int(h * scale))
+        if not is_template:
+            margin_x = max(MIN_SEARCH_MARGIN, int(w * self.search_margin_ratio))
+            margin_y = max(MIN_SEARCH_MARGIN, int(h * self.search_margin_ratio))
+            x, y, w, h = x - margin_x, y - margin_y, w + 2 * margin_x, h + 2 * margin_y
+        frame_width, frame_height = get_frame_size(frame.data, frame.pix_fmt)
+        x0, y0 = min(max(0, x), frame_width), min(max(0, y), frame_height)
+        region = crop_frame_to_gray(frame.data, frame.pix_fmt, x0, y0, x + w - x0, y + h - y0)
+        if self._mailbox.post(SearchRequest(region, (x0, y0), scale, timestamp, is_template)):
+            self._request_event.set()
+
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            if not self._request_event.wait(WORKER_WAIT_TIMEOUT):
+                continue
+            self._request_event.clear()
+            request = self._mailbox.take()
+            if request is None:
+                continue
+            try:
+                if request.is_template:
+                    self.set_template(request)
+                else:
+                    self.match(request)
+            except Exception as e:
+                self.debug.send(f"Local tracker error: {e}")
+
+
+    def set_template(self, request: SearchRequest) -> None:
+        with self._lock:
+            if request.region.shape[0] < MIN_TEMPLATE_SIZE or request.region.shape[1] < MIN_TEMPLATE_SIZE:
+                self._template = None
+            else:
+                self._template = request.region
+
+
+    def match(self, request: SearchRequest) -> None:
+        """
+        Finds the template in the search window and moves the local ROI to the best match
+        :param request: search window
+        :return None:
+        """
+        template = self._template
+        region = request.region
+        if template is None or region.shape[0] < template.shape[0] or region.shape[1] < template.shape[1]:
+            return
+        result = cv2.matchTemplate(region, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(result)
+        with self._lock:
+            if self._roi is None or template is not self._template or not self.is_stalled(request.timestamp):
+                return
+            self.last_score = score
+            if score < self.min_score:
+                if self._is_following:
+                    self.lost_count += 1
+                self._is_following = False
+                return
+            if self._stall_start_time is None:
+                self._stall_start_time = request.timestamp
+            self._roi[0] = (request.origin[0] + location[0]) / request.scale
+            self._roi[1] = (request.origin[1] + location[1]) / request.scale
+            self._is_following = True
+
+
+    def get_roi(self, now: float) -> list[int] | None:
+        """
+        Gets the locally tracked ROI while the server updates are stalled
+        :param now: wall-clock time of the frame being rendered
+        :return list[int] | None: [x, y, width, height] in stream coordinates or None when the server ROI is current
+        """
+        with self._lock:
+            if not self._is_following or not self.is_stalled(now):
+                return None
+            return [int(v) for v in self._roi]
+
+
+    def summary(self) -> str:
+        with self._lock:
+            count = self.divergence_count
+            if count == 0:
+                return f"Local tracker divergence: no stalls, lost {self.lost_count} times"
+            return (f"Local tracker divergence: n={count}, mean={self.divergence_total / count:.1f} px, "
+                    f"max={self.divergence_maximum:.1f} px, last={self.last_divergence:.1f} px, "
+                    f"lost {self.lost_count} times")
@@ -24,12 +24,22 @@ class Localization(QObject):
         super().__init__(parent)
         self.parent = parent
         self.ui = parent.ui if parent and hasattr(parent, "ui") else None
-        self.icons = init_icons()
+        self._icons = None
         self._strings = {}
         self.language = lang
         self.ru_lang_strings = {}
         self.en_lang_strings = {}
 
+    @property
+    def icons(self) -> dict:
+        """
+        Language icons, the compiled icon resources are loaded on first use
+        :return dict:
+        """
+        if self._icons is None:
+            self._icons = init_icons()
+        return self._icons
+
     def load_strings(self) -> None:
        try:
            with open(base_path / f"resources/lang/{RU_LANG}.json", encoding="utf-8-sig") as f:
@@ -48,11 +58,16 @@ class Localization(QObject):
         else:
             return self.en_lang_strings.get(key, key)
 
-    def set_localisation(self) -> None:
+    def set_localisation(self, update_icon=True) -> None:
+        """
+        Sets the strings of the current language to the widgets
+        :param update_icon: also sets the language icon, which loads the icon resources on first use
+        :return None:
+        """
         if not self.ui:
             raise Exception("UI is not initialized!")
 
-        if hasattr(self.ui, "language_tool_button"):
+        if update_icon and hasattr(self.ui, "language_tool_button"):
             self.ui.language_tool_button.setIcon(self.icons[self.language])
 
         if self.language == RU_LANG:
@@ -0,0 +1,87 @@
+﻿from PySide6.QtCore import Qt, QPoint, QRect
+from PySide6.QtGui import QImage, QPainter, QPen, QColor
+
+import cv2
+import numpy as np
+
+CROSSHAIR_COLOR = (0, 0, 255)
+CROSSHAIR_LENGTH = 8
+CROSSHAIR_THICKNESS = 2
+
+
+def create_pen(color, thickness) -> QPen:
+    """
+    Creates a pen with square caps, so lines cover the same pixels as the OpenCV ones
+    :param color: rgb tuple
+    :param thickness: line width in display pixels
+    :return QPen:
+    """
+    pen = QPen(QColor(*color))
+    pen.setWidth(max(1, int(thickness)))
+    pen.setCapStyle(Qt.PenCapStyle.SquareCap)
+    pen.setJoinStyle(Qt.PenJoinStyle.MiterJoin)
+    return pen
+
+
+def paint_crosshair(image: QImage, color=CROSSHAIR_COLOR, length=CROSSHAIR_LENGTH, thickness=CROSSHAIR_THICKNESS) -> QImage:
+    """
+    Paints a crosshair in the center of the displayed image
+    :param image: scaled view image, painted in place
+    :return QImage: the same image
+    """
+    center_x = image.width() // 2
+    center_y = image.height() // 2
+    painter = QPainter(image)
+    try:
+        painter.setPen(create_pen(color, thickness))
+        painter.drawLine(QPoint(center_x, center_y - length), QPoint(center_x, center_y + length))
+        painter.drawLine(QPoint(center_x - length, center_y), QPoint(center_x + length, center_y))
+    finally:
+        painter.end()
+    return image
+
+
+def image_to_array(image: QImage) -> np.ndarray | None:
+    """
+    Wraps the pixels of an rgb888 image into a numpy array without copying them, the row padding is skipped
+    :param image: image to draw on, it must outlive the array
+    :return np.ndarray | None: array of shape (height, width, 3) or None for other formats
+    """
+    if image.format() != QImage.Format_RGB888 or image.isNull():
+        return None
+    width, height, bytes_per_line = image.width(), image.height(), image.bytesPerLine()
+    data = np.frombuffer(image.bits(), dtype=np.uint8, count=bytes_per_line * height)
+    return data.reshape(height, bytes_per_line)[:, :width * 3].reshape(height, width, 3)
+
+
+def paint_polyline(image: QImage, points: np.ndarray, color, thickness) -> QImage:
+    """
+    Paints an open polyline through the given points in one cv2.polylines call
+    :param image: scaled rgb888 view image, painted in place
+    :param points: int32 array of shape (n, 2) in image coordinates
+    :return QImage: the same image
+    """
+    if len(points) < 2:
+        return image
+    array = image_to_array(image)
+    if array is None:
+        return image
+    cv2.polylines(array, [points], False, color, max(1, int(thickness)), cv2.LINE_AA)
+    return image
+
+
+def paint_rectangle(image: QImage, p1, p2, color, thickness) -> QImage:
+    """
+    Paints a rectangle outline given by two opposite corners in image coordinates
+    :param image: scaled view image, painted in place
+    :return QImage: the same image
+    """
+    painter = QPainter(image)
+    try:
+        painter.setPen(create_pen(color, thickness))
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        painter.drawRect(QRect(QPoint(min(p1[0], p2[0]), min(p1[1], p2[1])),
+                               QPoint(max(p1[0], p2[0]), max(p1[1], p2[1]))))
+    finally:
+        painter.end()
+    return image
@@ -1,40 +1,333 @@
-﻿class WrapperPipeline:
-    def __init__(self):
+﻿import threading
+import time
+
+import numpy as np
+
+from src.latency import LatencyHistogram
+from src.tools import DebugEmitter
+
+TIMING_LOG_INTERVAL = 10
+PRIORITY_STEP = 10
+
+# Bin edges in milliseconds: 0 and 97 log-spaced edges from 1 us to 1 s, most stages take well under a millisecond
+STAGE_TIMING_BIN_EDGES = [0.0] + list(np.geomspace(1e-3, 1e3, 97))
+STAGE_TIMING_PRECISION = 3
+
+
+class PipelineStep:
+    """
+    A registered operation. Steps are never modified after registration, a change replaces the snapshot
+    """
+    __slots__ = ("name", "operation", "mutates_input", "priority", "order", "timing")
+
+    def __init__(self, name, operation, mutates_input, priority, order):
+        self.name = name
+        self.operation = operation
+        self.mutates_input = mutates_input
+        self.priority = priority
+        self.order = order
+        self.timing = LatencyHistogram(name, STAGE_TIMING_BIN_EDGES, STAGE_TIMING_PRECISION)
+
+
+class PipelineSnapshot:
+    """
+    Immutable list of the active steps with the version it was built at
+    """
+    __slots__ = ("version", "steps")
+
+    def __init__(self, version: int, steps: tuple):
+        self.version = version
+        self.steps = steps
+
+
+class WrapperPipeline:
+    """
+    Runs the registered operations in order of their priority (lower first, then registration order),
+    each one gets the result of the previous one.
+    Registering, removing, enabling and disabling operations publish a new immutable snapshot of the active
+    steps under a lock, process picks the current snapshot up once per call, so the pipeline can be
+    reconfigured from the GUI thread while another thread is processing.
+    An operation registered with mutates_input=True draws into the array it gets and returns it.
+    The pipeline makes sure such an operation never writes into the protected input (the frame other
+    consumers still read): it is copied once per frame into the pipeline's working buffer before the first
+    mutating operation. Arrays produced by earlier operations are private and are mutated without a copy.
+    With timing enabled the duration of every operation is collected and logged periodically.
+    """
+    def __init__(self, name="pipeline"):
+        self.name = name
         self.available_operations = {}
-        self.active_pipeline_steps = []
         self.operation_enabled_status = {}
+        self.snapshot = PipelineSnapshot(0, ())
+        self.working_buffer = None
+        self.timing_enabled = False
+        self.timing_log_interval = TIMING_LOG_INTERVAL
+        self.last_timing_log_time = 0.0
+        self.debug = DebugEmitter()
+        self._registration_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active_pipeline_steps(self) -> tuple:
+        return self.snapshot.steps
+
+    def get_version(self) -> int:
+        return self.snapshot.version
 
-    def register_operation(self, operation, name, default_enabled=True):
-        if name in self.available_operations:
-            raise Exception(f"Operation '{name}' is already registered!")
-        self.available_operations[name] = operation
-        self.operation_enabled_status[name] = default_enabled
-        self.rebuild_pipeline()
+    def register_operation(self, operation, name, default_enabled=True, mutates_input=False, priority=None):
+        """
+        Registers an operation
+        :param operation: callable taking the result of the previous operation
+        :param name: unique name
+        :param default_enabled:
+        :param mutates_input: the operation writes into its input
+        :param priority: position in the pipeline, by default after all operations registered before
+        :return None:
+        """
+        with self._lock:
+            if name in self.available_operations:
+                raise Exception(f"Operation '{name}' is already registered!")
+            if priority is None:
+                priority = (len(self.available_operations) + 1) * PRIORITY_STEP
+            self.available_operations[name] = PipelineStep(name, operation, mutates_input, priority, self._registration_count)
+            self._registration_count += 1
+            self.operation_enabled_status[name] = default_enabled
+            self.rebuild_pipeline()
 
     def remove_operation(self, name):
-        if name in self.available_operations:
-            del self.available_operations[name]
+        with self._lock:
+            if name in self.available_operations:
+                del self.available_operations[name]
+                del self.operation_enabled_status[name]
+                self.rebuild_pipeline()
 
     def enable_operation(self, name):
-        if name not in self.available_operations:
-            raise Exception(f"Can not enable operation '{name}' because it is not registered!")
-        self.operation_enabled_status[name] = True
-        self.rebuild_pipeline()
+        self.set_operation_enabled(name, True)
 
     def disable_operation(self, name):
-        if name not in self.available_operations:
-            raise Exception(f"Can not disable operation '{name}' because it is not registered!")
-        self.operation_enabled_status[name] = False
-        self.rebuild_pipeline()
+        self.set_operation_enabled(name, False)
+
+    def set_operation_enabled(self, name, enabled):
+        with self._lock:
+            if name not in self.available_operations:
+                raise Exception(f"Can not {'enable' if enabled else 'disable'} operation '{name}' because it is not registered!")
+            if self.operation_enabled_status[name] == enabled:
+                return
+            self.operation_enabled_status[name] = enabled
+            self.rebuild_pipeline()
 
     def rebuild_pipeline(self):
-        self.active_pipeline_steps = []
-        for name, operation in self.available_operations.items():
-            if self.operation_enabled_status[name]:
-                self.active_pipeline_steps.append(operation)
+        # Called with the lock held
+        steps = sorted((step for name, step in self.available_operations.items() if self.operation_enabled_status[name]),
+                       key=lambda step: (step.priority, step.order))
+        self.snapshot = PipelineSnapshot(self.snapshot.version + 1, tuple(steps))
+
+    def enable_timing(self, enabled=True, log_interval=TIMING_LOG_INTERVAL):
+        """
+        Turns the per operation timing on or off
+        :param enabled:
+        :param log_interval: seconds between the timing dumps to the log, 0 disables them
+        :return None:
+        """
+        self.timing_log_interval = log_interval
+        self.last_timing_log_time = time.monotonic()
+        self.timing_enabled = enabled
+
+    def get_timings(self) -> dict:
+        """
+        Gets count, mean, p50, p95, p99 and max duration in milliseconds of every operation that has run
+        :return dict: statistics by operation name
+        """
+        return {step.name: step.timing.as_dict() for step in self.get_steps() if step.timing.count}
+
+    def reset_timings(self):
+        for step in self.get_steps():
+            step.timing.reset()
+
+    def get_steps(self) -> list:
+        with self._lock:
+            return sorted(self.available_operations.values(), key=lambda step: (step.priority, step.order))
+
+    def timing_summary(self) -> str:
+        lines = [f"{self.name} timing:"]
+        for step in self.get_steps():
+            if step.timing.count:
+                lines.append(f"  {step.timing.summary()}")
+        return "\n".join(lines)
+
+    def log_timings(self):
+        if self.timing_enabled:
+            self.debug.send(self.timing_summary())
 
-    def process(self, initial_data):
+    def get_working_buffer(self, data: np.ndarray) -> np.ndarray:
+        if self.working_buffer is None or self.working_buffer.shape != data.shape or self.working_buffer.dtype != data.dtype:
+            self.working_buffer = np.empty_like(data)
+        return self.working_buffer
+
+    def process(self, initial_data, protected=None):
+        """
+        Runs the active operations of the current snapshot
+        :param initial_data: input of the first operation
+        :param protected: array the operations must not write into, by default the input array
+        or the data array of the input frame
+        :return: result of the last operation
+        """
+        if protected is None:
+            protected = initial_data if isinstance(initial_data, np.ndarray) else getattr(initial_data, "data", None)
+        steps = self.snapshot.steps
+        timing_enabled = self.timing_enabled
         current_data = initial_data
-        for operation in self.active_pipeline_steps:
-            current_data = operation(current_data)
+        for step in steps:
+            if timing_enabled:
+                start_time = time.perf_counter()
+            if step.mutates_input and isinstance(current_data, np.ndarray) and protected is not None \
+                    and np.may_share_memory(current_data, protected):
+                working_buffer = self.get_working_buffer(current_data)
+                np.copyto(working_buffer, current_data)
+                current_data = working_buffer
+                protected = None
+            current_data = step.operation(current_data)
+            if timing_enabled:
+                step.timing.add(time.perf_counter() - start_time)
+        if timing_enabled and self.timing_log_interval:
+            now = time.monotonic()
+            if now - self.last_timing_log_time >= self.timing_log_interval:
+                self.last_timing_log_time = now
+                self.log_timings()
         return current_data
+
+
+def get_protected_array(data, fallback=None):
+    """
+    Gets the array the consumers of data must not write into
+    :param data: array or frame with a data array
+    :param fallback: returned when data holds no array
+    :return: np.ndarray or fallback
+    """
+    if isinstance(data, np.ndarray):
+        return data
+    array = getattr(data, "data", None)
+    return array if isinstance(array, np.ndarray) else fallback
+
+
+class PipelineNode:
+    """
+    A stage of a pipeline graph
+    """
+    __slots__ = ("name", "pipeline", "parent", "enabled")
+
+    def __init__(self, name, pipeline: WrapperPipeline, parent, enabled):
+        self.name = name
+        self.pipeline = pipeline
+        self.parent = parent
+        self.enabled = enabled
+
+
+class PipelineGraph:
+    """
+    Tree of pipelines processing a frame: a node's pipeline runs once per frame on the output of its parent
+    and its output fans out to all child nodes. Nodes without children are sinks, their outputs are the results.
+    A disabled node skips its whole subtree and a shared node runs only while it has an enabled sink below it.
+    The output of a node with several active children is protected, mutating operations of the children
+    get their own copy of it. Changes publish a new immutable plan like WrapperPipeline does
+    """
+    def __init__(self, name="graph"):
+        self.name = name
+        self.nodes = {}
+        self.plan = ()
+        self._lock = threading.Lock()
+
+    def add_node(self, name, parent=None, enabled=True) -> WrapperPipeline:
+        """
+        Adds a node, nodes have to be added after their parent
+        :param name: unique node name
+        :param parent: name of the node whose output is the input of this node, None for the graph input
+        :param enabled:
+        :return WrapperPipeline: the pipeline of the node to register operations on
+        """
+        with self._lock:
+            if name in self.nodes:
+                raise Exception(f"Node '{name}' is already added!")
+            if parent is not None and parent not in self.nodes:
+                raise Exception(f"Can not add node '{name}' because its parent '{parent}' is not added!")
+            pipeline = WrapperPipeline(f"{self.name}/{name}")
+            self.nodes[name] = PipelineNode(name, pipeline, parent, enabled)
+            self.rebuild_plan()
+            return pipeline
+
+    def get_pipeline(self, name) -> WrapperPipeline:
+        return self.nodes[name].pipeline
+
+    def enable_node(self, name):
+        self.set_node_enabled(name, True)
+
+    def disable_node(self, name):
+        self.set_node_enabled(name, False)
+
+    def set_node_enabled(self, name, enabled):
+        with self._lock:
+            if name not in self.nodes:
+                raise Exception(f"Can not {'enable' if enabled else 'disable'} node '{name}' because it is not added!")
+            if self.nodes[name].enabled == enabled:
+                return
+            self.nodes[name].enabled = enabled
+            self.rebuild_plan()
+
+    def is_node_enabled(self, name) -> bool:
+        return self.nodes[name].enabled
+
+    def rebuild_plan(self):
+        # Called with the lock held. Nodes are stored in insertion order, so parents come before children
+        children = {name: [] for name in self.nodes}
+        for node in self.nodes.values():
+            if node.parent is not None:
+                children[node.parent].append(node.name)
+
+        def is_active(name) -> bool:
+            node = self.nodes[name]
+            if not node.enabled:
+                return False
+            if not children[name]:
+                return True
+            return any(is_active(child) for child in children[name])
+
+        plan = []
+        active = set()
+        for name, node in self.nodes.items():
+            if (node.parent is None or node.parent in active) and is_active(name):
+                active.add(name)
+                active_children = [child for child in children[name] if is_active(child)]
+                plan.append((node.name, node.parent, node.pipeline, not children[name], len(active_children) > 1))
+        self.plan = tuple(plan)
+
+    def process(self, initial_data) -> dict:
+        """
+        Runs the active nodes of the current plan
+        :param initial_data: input of the root nodes
+        :return dict: outputs of the active sinks by node name
+        """
+        plan = self.plan
+        root_protected = get_protected_array(initial_data)
+        outputs = {}
+        results = {}
+        for name, parent, pipeline, is_sink, is_shared in plan:
+            if parent is None:
+                data, protected = initial_data, root_protected
+            else:
+                data, protected = outputs[parent]
+            output = pipeline.process(data, protected)
+            if is_sink:
+                results[name] = output
+            else:
+                outputs[name] = (output, get_protected_array(output, protected) if is_shared else protected)
+        return results
+
+    def enable_timing(self, enabled=True, log_interval=TIMING_LOG_INTERVAL):
+        for node in list(self.nodes.values()):
+            node.pipeline.enable_timing(enabled, log_interval)
+
+    def get_timings(self) -> dict:
+        return {name: node.pipeline.get_timings() for name, node in list(self.nodes.items())}
+
+    def log_timings(self):
+        for node in list(self.nodes.values()):
+            node.pipeline.log_timings()
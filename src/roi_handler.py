@@ -1,4 +1,5 @@
-﻿import threading
+﻿import math
+import threading
 import time
 
 from PySide6.QtCore import Signal, QObject
@@ -12,10 +13,17 @@ from enum import Enum
 from typing import Tuple
 
 from src.tools import DebugEmitter
+from src.overlay import paint_rectangle, paint_polyline
+from src.roi_interpolator import ROIInterpolator, DEFAULT_INTERPOLATION_DURATION
+from src.roi_predictor import ROIMotionPredictor
+from src.roi_trajectory import ROITrajectory, DEFAULT_TRAIL_DURATION
+from src.local_tracker import LocalTracker
+from src.frame_buffer import StreamFrame
 
 SELECTING_ROI_COLOR = (0, 0, 255)
 TRACKING_ROI_COLOR = (0, 255, 0)
 FAILED_ROI_COLOR = (255, 0, 0)
+TRAIL_COLOR = (255, 255, 0)
 
 ROI_THICKNESS_DEFAULT = 1
 
@@ -23,6 +31,8 @@ INIT_START_POINT = [0, 0]
 INIT_END_POINT = [0, 0]
 INIT_ROI = [0, 0, 0, 0]
 
+TRACKER_CORRELATION_KEYS = ("correlation", "psr", "confidence", "score")
+
 
 OPTIMAL_ROI_SQUARE_SIZES = [32, 36, 40, 42, 45, 48, 49, 50, 54, 56, 60, 64, 72, 75, 80, 81, 84, 90, 96, 100, 108, 112, 120, 125, 126, 128]
 
@@ -39,7 +49,7 @@ class ROIHandler(QObject):
 
     roi_selected_signal = Signal(np.ndarray)
 
-    def __init__(self, parent=None, view_label=None, roi_label=None, stream_size=None, interpolation_step=1/30):
+    def __init__(self, parent=None, view_label=None, roi_label=None, stream_size=None):
         super().__init__(parent)
         self.parent = parent
         self.roi = None
@@ -53,16 +63,22 @@ class ROIHandler(QObject):
         self.view_label = view_label
         self.roi_label = roi_label
 
-        self._stop_smooth_event  = threading.Event()
-        self._smooth_update_thread = None
         self._is_mouse_pressed = False
         self._roi_lock = threading.Lock()
 
         self.debug = DebugEmitter()
         self.set_roi(INIT_ROI)
 
-        self.interpolation_step = interpolation_step
-        self.interpolation_duration = 0.3
+        self.interpolation_duration = DEFAULT_INTERPOLATION_DURATION
+        self.roi_interpolator = ROIInterpolator(self.interpolation_duration)
+        self.roi_predictor = None
+        self.local_tracker = None
+        self.frame_roi = None
+
+        self.trajectory = ROITrajectory()
+        self.trail_duration = DEFAULT_TRAIL_DURATION
+        self.tracking_start_time = 0.0
+        self.tracker_correlation = math.nan
 
         self.fast_roi_width = 0
         self.fast_roi_height = 0
@@ -91,10 +107,15 @@ class ROIHandler(QObject):
         self.enabled = False
 
 
-    def add_roi_to_frame(self, frame: np.ndarray, p1, p2, color) -> np.ndarray:
-        cv_frame = frame.copy()
-        cv2.rectangle(cv_frame, p1, p2, color, self.get_roi_thickness())
-        return cv_frame
+    def get_frame_scale(self, frame: np.ndarray) -> float:
+        """
+        Gets the scale from stream coordinates to the frame, frames can be scaled to the display size
+        :param frame: frame in any pixel format, its width is the number of columns
+        :return float:
+        """
+        if not self.stream_size or self.stream_size[0] == 0 or frame.shape[1] == self.stream_size[0]:
+            return 1.0
+        return frame.shape[1] / self.stream_size[0]
 
 
     def qimage_to_cv2_matlike(self, image, width, height) -> np.ndarray:
@@ -150,59 +171,141 @@ class ROIHandler(QObject):
             return
         if all(v == 0 for v in roi):
             self.change_state(ROIState.FAILED)
+            self.roi_interpolator.reset()
+            self.record_trajectory(self.get_roi(), time.time())
+            if self.local_tracker is not None:
+                self.local_tracker.reset()
         else:
             width_offset = self.stream_size[0] / self.tracking_frame_size[0]
             height_offset = self.stream_size[1] / self.tracking_frame_size[1]
             new_roi = [int(roi[0] * width_offset), int(roi[1] * height_offset),
                        int(roi[2] * width_offset), int(roi[3] * height_offset)]
-            if self.get_roi() == new_roi:
-                if self.current_state != ROIState.TRACKING:
-                    self.change_state(ROIState.TRACKING)
-                return
-
-            if self.current_state == ROIState.TRACKING:
-                if self._smooth_update_thread and self._smooth_update_thread.is_alive():
-                    self._stop_smooth_event.set()
-                    self._smooth_update_thread.join(timeout=self.interpolation_duration + 0.1)
-
-                self._stop_smooth_event.clear()
-
-                self._smooth_update_thread = threading.Thread(
-                    target=self.smooth_update_roi,
-                    args=(new_roi,),
-                    daemon=True
-                )
-                self._smooth_update_thread.start()
-            else:
-                self.set_roi(new_roi)
+            update_time = time.time()
+            is_tracking = self.current_state == ROIState.TRACKING
+            if not is_tracking:
+                # A new tracking session starts from the server ROI, not from the last target of the previous one
+                self.tracking_start_time = update_time
+                self.roi_interpolator.jump_to(new_roi)
+                if self.roi_predictor is not None:
+                    self.roi_predictor.reset()
+                if self.local_tracker is not None:
+                    self.local_tracker.reset()
                 self.change_state(ROIState.TRACKING)
+            if self.local_tracker is not None:
+                self.local_tracker.resync(new_roi, update_time)
+            # Unchanged ROIs are fed to the predictor too, so it sees a stopped target slow down
+            if self.roi_predictor is not None:
+                self.roi_predictor.update(new_roi, update_time)
+            if is_tracking and self.get_roi() != new_roi:
+                self.roi_interpolator.set_target(new_roi, update_time)
+            self.set_roi(new_roi)
+            self.record_trajectory(new_roi, update_time)
 
 
-    def smooth_update_roi(self, new_roi) -> None:
-        old_roi = self.get_roi()
-        start_time = time.time()
+    def record_trajectory(self, roi, timestamp: float) -> None:
+        self.trajectory.append(timestamp, roi, self.current_state.value, self.tracker_correlation)
+        self.tracker_correlation = math.nan
 
-        while not self._stop_smooth_event.is_set():
-            elapsed_time = time.time() - start_time
 
-            progress = elapsed_time / self.interpolation_duration
-            if progress >= 1.0:
-                break
-            x = old_roi[0] + (new_roi[0] - old_roi[0]) * progress
-            y = old_roi[1] + (new_roi[1] - old_roi[1]) * progress
-            w = old_roi[2] + (new_roi[2] - old_roi[2]) * progress
-            h = old_roi[3] + (new_roi[3] - old_roi[3]) * progress
+    def update_tracker_data(self, data: dict) -> None:
+        """
+        Keeps the correlation reported by the tracker for the trajectory sample of the ROI that follows the data
+        :param data: tracker data message
+        :return None:
+        """
+        for key in TRACKER_CORRELATION_KEYS:
+            value = data.get(key)
+            if isinstance(value, (int, float)):
+                self.tracker_correlation = float(value)
+                return
 
-            current_roi = [int(x), int(y), int(w), int(h)]
-            self.set_roi(current_roi)
 
-            time.sleep(self.interpolation_step)
+    def paint_trail(self, image: QImage) -> QImage:
+        """
+        Paints the path of the ROI center during the last trail_duration seconds of the current tracking
+        :param image: view image scaled to the label
+        :return QImage: the same image
+        """
+        if self.current_state != ROIState.TRACKING:
+            return image
+        if not self.stream_size or self.stream_size[0] == 0 or self.stream_size[1] == 0 or image.width() == 0:
+            return image
+        width_ratio, height_ratio = self.calculate_size_ratios(image)
+        since = max(self.tracking_start_time, time.time() - self.trail_duration)
+        points = self.trajectory.get_trail_points(since, width_ratio, height_ratio)
+        thickness = max(1, round(self.get_roi_thickness() / width_ratio))
+        return paint_polyline(image, points, TRAIL_COLOR, thickness)
+
+
+    def enable_prediction(self, enabled=True, measurement_delay=0.0) -> None:
+        """
+        Turns the client-side ROI motion prediction on or off. While it is on the tracked ROI is extrapolated
+        to the time of the rendered frame instead of interpolated
+        :param measurement_delay: seconds between the server capturing a frame and its ROI being received
+        :return None:
+        """
+        self.roi_predictor = ROIMotionPredictor(measurement_delay=measurement_delay) if enabled else None
+
+
+    def get_prediction_summary(self) -> str | None:
+        roi_predictor = self.roi_predictor
+        return roi_predictor.summary() if roi_predictor is not None else None
+
+
+    def enable_local_tracking(self, enabled=True) -> None:
+        """
+        Turns the client-side fallback tracker on or off, it follows the target while the server ROI updates stall
+        :return None:
+        """
+        if self.local_tracker is not None:
+            self.local_tracker.stop()
+        self.local_tracker = LocalTracker() if enabled else None
+        if self.local_tracker is not None:
+            self.local_tracker.start()
+
+
+    def submit_tracking_frame(self, frame: StreamFrame) -> None:
+        """
+        Hands the frame to the fallback tracker, must be called from the render thread
+        :return None:
+        """
+        local_tracker = self.local_tracker
+        if local_tracker is not None and self.current_state == ROIState.TRACKING:
+            local_tracker.submit(frame, self.get_frame_scale(frame.data))
+
+
+    def get_local_tracker_summary(self) -> str | None:
+        local_tracker = self.local_tracker
+        return local_tracker.summary() if local_tracker is not None else None
+
+
+    def prepare_frame(self, frame_time: float) -> None:
+        """
+        Evaluates the ROI for the frame about to be rendered, so every overlay of the frame uses the same ROI.
+        Must be called from the render thread before the frame is rendered
+        :param frame_time: wall-clock receive time of the frame, 0 when unknown
+        :return None:
+        """
         if self.current_state == ROIState.TRACKING:
-            self.set_roi(new_roi)
+            frame_time = frame_time if frame_time else time.time()
+            local_tracker = self.local_tracker
+            frame_roi = local_tracker.get_roi(frame_time) if local_tracker is not None else None
+            roi_predictor = self.roi_predictor
+            if frame_roi is None and roi_predictor is not None:
+                frame_roi = roi_predictor.predict(frame_time)
+            self.frame_roi = frame_roi if frame_roi is not None else self.roi_interpolator.value_at(frame_time)
+        else:
+            self.frame_roi = None
 
 
-    def set_interpolation_step(self, step) -> None:
-        self.interpolation_step = step
+    def get_frame_roi(self) -> list[int, int, int, int]:
+        """
+        Gets the ROI of the frame being rendered: followed locally, predicted or interpolated while tracking,
+        the current ROI otherwise
+        :return list[int, int, int, int]:
+        """
+        frame_roi = self.frame_roi
+        return frame_roi if frame_roi is not None else self.get_roi()
 
 
     def reset_points(self) -> None:
@@ -215,6 +318,7 @@ class ROIHandler(QObject):
             self.reset_fast_roi()
         else:
             self.change_state(ROIState.NONE)
+            self.roi_interpolator.reset()
             self.set_roi(INIT_ROI)
 
 
@@ -305,9 +409,17 @@ class ROIHandler(QObject):
                               max(0, min(int((y - offset_y) * height_ratio), int(pixmap.height() * height_ratio) - 1))]
 
 
+    def calculate_size_ratios(self, image) -> tuple[float, float]:
+        """
+        Gets the stream pixels per displayed pixel, it does not read the label, so it can be used off the GUI thread
+        :param image: QPixmap or QImage scaled to the label
+        :return tuple[float, float]: width and height ratios
+        """
+        return self.stream_size[0] / image.width(), self.stream_size[1] / image.height()
+
+
     def calculate_offsets_and_size_ratios(self, pixmap) -> tuple[int, int, float, float]:
-        width_ratio = self.stream_size[0] / pixmap.width()
-        height_ratio = self.stream_size[1] / pixmap.height()
+        width_ratio, height_ratio = self.calculate_size_ratios(pixmap)
         offset_x = max(0, (self.view_label.width() - pixmap.width()) // 2)
         offset_y = max(0, (self.view_label.height() - pixmap.height()) // 2)
         return offset_x, offset_y, width_ratio, height_ratio
@@ -383,28 +495,32 @@ class ROIHandler(QObject):
         self.current_state = state
 
 
-    def get_roi_points(self) -> Tuple[Tuple[int, int], Tuple[int, int]]:
-        roi = self.get_roi()
+    def get_roi_points(self, roi=None) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        if roi is None:
+            roi = self.get_roi()
         p1 = (roi[0], roi[1])
         p2 = (roi[0] + roi[2], roi[1] + roi[3])
         return p1, p2
 
 
-    def draw_roi(self, frame) -> np.ndarray:
+    def paint_roi(self, image: QImage) -> QImage:
+        """
+        Paints the ROI on the scaled view image, so the outline is always at least one display pixel wide
+        :param image: view image scaled to the label
+        :return QImage: the same image
+        """
         if self.current_state == ROIState.SELECTING or self.current_state == ROIState.FAST_SELECTING:
-            return self.add_roi_to_frame(frame, self.start_point, self.end_point, SELECTING_ROI_COLOR)
+            p1, p2, color = self.start_point, self.end_point, SELECTING_ROI_COLOR
         elif self.current_state == ROIState.TRACKING:
-            p1, p2 = self.get_roi_points()
-            return self.add_roi_to_frame(frame, p1, p2, TRACKING_ROI_COLOR)
+            (p1, p2), color = self.get_roi_points(self.get_frame_roi()), TRACKING_ROI_COLOR
         elif self.current_state == ROIState.FAILED:
-            p1, p2 = self.get_roi_points()
-            return self.add_roi_to_frame(frame, p1, p2, FAILED_ROI_COLOR)
-        return frame
-
-
-    def draw_roi_wrapper(self, func) -> None:
-        def wrapper(*args, **kwargs):
-            args = list(args)
-            args[0] = self.draw_roi(args[0])
-            return func(*args, **kwargs)
-        return wrapper
+            (p1, p2), color = self.get_roi_points(), FAILED_ROI_COLOR
+        else:
+            return image
+        if not self.stream_size or self.stream_size[0] == 0 or self.stream_size[1] == 0 or image.width() == 0:
+            return image
+        width_ratio, height_ratio = self.calculate_size_ratios(image)
+        p1 = (int(p1[0] / width_ratio), int(p1[1] / height_ratio))
+        p2 = (int(p2[0] / width_ratio), int(p2[1] / height_ratio))
+        thickness = max(1, round(self.get_roi_thickness() / width_ratio))
+        return paint_rectangle(image, p1, p2, color, thickness)
@@ -0,0 +1,74 @@
+﻿import threading
+import time
+
+DEFAULT_INTERPOLATION_DURATION = 0.3
+
+
+class ROIInterpolator:
+    """
+    Moves the ROI linearly from where it was when a new target arrived to the target over the interpolation duration.
+    Nothing runs in the background, the ROI is evaluated on demand for the timestamp of the frame being rendered,
+    so setting a target is O(1) and the motion is in step with the displayed frames
+    """
+
+    def __init__(self, duration=DEFAULT_INTERPOLATION_DURATION):
+        self.duration = duration
+        self.start_roi = None
+        self.target_roi = None
+        self.start_time = 0.0
+        self._lock = threading.Lock()
+
+
+    def set_target(self, roi, timestamp: float = None) -> None:
+        """
+        Starts moving from the current position to the new ROI
+        :param roi: [x, y, width, height]
+        :param timestamp: wall-clock time the ROI was received at
+        :return None:
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            self.start_roi = self._value_at(timestamp) if self.target_roi is not None else list(roi)
+            self.target_roi = list(roi)
+            self.start_time = timestamp
+
+
+    def jump_to(self, roi) -> None:
+        """
+        Places the ROI without interpolation
+        :param roi: [x, y, width, height]
+        :return None:
+        """
+        with self._lock:
+            self.start_roi = list(roi)
+            self.target_roi = list(roi)
+            self.start_time = 0.0
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self.start_roi = None
+            self.target_roi = None
+            self.start_time = 0.0
+
+
+    def value_at(self, timestamp: float) -> list[int] | None:
+        """
+        Gets the ROI at the given time
+        :param timestamp: wall-clock time, usually the receive time of the frame being rendered
+        :return list[int] | None: [x, y, width, height] or None if no ROI was set
+        """
+        with self._lock:
+            if self.target_roi is None:
+                return None
+            return self._value_at(timestamp)
+
+
+    def _value_at(self, timestamp: float) -> list[int]:
+        if self.duration <= 0:
+            progress = 1.0
+        else:
+            progress = min(1.0, max(0.0, (timestamp - self.start_time) / self.duration))
+        if progress >= 1.0:
+            return list(self.target_roi)
+        return [int(start + (target - start) * progress) for start, target in zip(self.start_roi, self.target_roi)]
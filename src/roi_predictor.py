@@ -0,0 +1,133 @@
+﻿import threading
+
+import numpy as np
+
+PREDICTION_ALPHA = 0.7
+PREDICTION_BETA = 0.3
+MAX_PREDICTION_HORIZON = 0.5
+# Updates closer than half a frame period at 60 fps arrived in one read and carry no timing information
+MIN_UPDATE_INTERVAL = 1 / 120
+MAX_VELOCITY = 2000.0
+
+
+class ROIMotionPredictor:
+    """
+    Constant-velocity alpha-beta filter over the server ROI updates (center, width and height).
+    It extrapolates the ROI to the timestamp of the frame being rendered to hide the network and decode latency.
+    Every server update is also compared with what was predicted for its time: the prediction error,
+    and the error of just holding the previous ROI for reference, are reported in pixels of the ROI center
+    """
+
+    def __init__(self, alpha=PREDICTION_ALPHA, beta=PREDICTION_BETA, max_horizon=MAX_PREDICTION_HORIZON,
+                 measurement_delay=0.0, min_interval=MIN_UPDATE_INTERVAL, max_velocity=MAX_VELOCITY):
+        self.alpha = alpha
+        self.beta = beta
+        self.max_horizon = max_horizon
+        self.min_interval = min_interval
+        self.max_velocity = max_velocity
+        self.measurement_delay = measurement_delay
+        self.position = np.zeros(4, dtype=np.float64)
+        self.velocity = np.zeros(4, dtype=np.float64)
+        self.last_time = None
+        self._lock = threading.Lock()
+        self.reset_errors()
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self.velocity[:] = 0
+            self.last_time = None
+
+
+    def reset_errors(self) -> None:
+        self.error_count = 0
+        self.error_total = 0.0
+        self.error_maximum = 0.0
+        self.last_error = 0.0
+        self.hold_error_total = 0.0
+
+
+    @staticmethod
+    def roi_to_state(roi) -> np.ndarray:
+        x, y, w, h = roi
+        return np.array((x + w / 2, y + h / 2, w, h), dtype=np.float64)
+
+
+    @staticmethod
+    def state_to_roi(state: np.ndarray) -> list[int]:
+        w = max(1.0, state[2])
+        h = max(1.0, state[3])
+        return [int(state[0] - w / 2), int(state[1] - h / 2), int(w), int(h)]
+
+
+    def update(self, roi, timestamp: float) -> None:
+        """
+        Feeds a server ROI. Updates arriving less than min_interval after the previous one were received
+        in one batch, the newest one replaces the position without touching the velocity
+        :param roi: [x, y, width, height]
+        :param timestamp: wall-clock time the ROI was received at
+        :return None:
+        """
+        measured = self.roi_to_state(roi)
+        timestamp -= self.measurement_delay
+        with self._lock:
+            if self.last_time is None:
+                self.position[:] = measured
+                self.velocity[:] = 0
+                self.last_time = timestamp
+                return
+            dt = timestamp - self.last_time
+            if dt < self.min_interval:
+                self.position[:] = measured
+                return
+            predicted = self.position + self.velocity * dt
+            residual = measured - predicted
+
+            error = float(np.hypot(residual[0], residual[1]))
+            self.error_count += 1
+            self.error_total += error
+            self.error_maximum = max(self.error_maximum, error)
+            self.last_error = error
+            self.hold_error_total += float(np.hypot(measured[0] - self.position[0], measured[1] - self.position[1]))
+
+            self.position[:] = predicted + self.alpha * residual
+            self.velocity += self.beta * residual / dt
+            np.clip(self.velocity, -self.max_velocity, self.max_velocity, out=self.velocity)
+            self.last_time = timestamp
+
+
+    def predict(self, timestamp: float) -> list[int] | None:
+        """
+        Extrapolates the ROI to the given time, at most max_horizon past the last update
+        :param timestamp: wall-clock time, usually the receive time of the frame being rendered
+        :return list[int] | None: [x, y, width, height] or None before the first update
+        """
+        with self._lock:
+            if self.last_time is None:
+                return None
+            dt = min(max(0.0, timestamp - self.last_time), self.max_horizon)
+            return self.state_to_roi(self.position + self.velocity * dt)
+
+
+    def get_error_stats(self) -> dict:
+        """
+        Gets the prediction error against the server updates in pixels
+        :return dict:
+        """
+        with self._lock:
+            count = self.error_count
+            return {
+                "count": count,
+                "mean": self.error_total / count if count else 0.0,
+                "max": self.error_maximum,
+                "last": self.last_error,
+                "hold_mean": self.hold_error_total / count if count else 0.0
+            }
+
+
+    def summary(self) -> str:
+        stats = self.get_error_stats()
+        if stats["count"] == 0:
+            return "ROI prediction error: no samples"
+        return (f"ROI prediction error: n={stats['count']}, mean={stats['mean']:.1f} px, max={stats['max']:.1f} px, "
+                f"last={stats['last']:.1f} px (without prediction mean={stats['hold_mean']:.1f} px)")
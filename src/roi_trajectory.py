@@ -0,0 +1,177 @@
+﻿import math
+import threading
+
+import numpy as np
+
+DEFAULT_TRAJECTORY_CAPACITY = 36000
+DEFAULT_TRAIL_DURATION = 5.0
+
+TIMESTAMP, X, Y, WIDTH, HEIGHT, STATE, CORRELATION = range(7)
+SAMPLE_FIELDS = 7
+
+
+class ROITrajectory:
+    """
+    Fixed-size ring buffer of ROI samples (timestamp, x, y, width, height, state, correlation).
+    All memory is allocated up front, so appending at tracking rate never allocates and the oldest samples
+    are overwritten in long sessions. Samples are appended in time order, so time windows are found by bisection
+    """
+
+    def __init__(self, capacity=DEFAULT_TRAJECTORY_CAPACITY):
+        self.capacity = capacity
+        self._samples = np.full((capacity, SAMPLE_FIELDS), np.nan, dtype=np.float64)
+        self._centers = np.empty((capacity, 2), dtype=np.float64)
+        self._points = np.empty((capacity, 2), dtype=np.int32)
+        self._index = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._index = 0
+            self._count = 0
+
+
+    def __len__(self) -> int:
+        return self._count
+
+
+    def append(self, timestamp: float, roi, state: int, correlation=math.nan) -> None:
+        """
+        Appends a sample overwriting the oldest one when the buffer is full
+        :param timestamp: wall-clock time of the sample
+        :param roi: [x, y, width, height] in stream coordinates
+        :param state: ROIState value
+        :param correlation: tracker correlation reported with the ROI, nan when unknown
+        :return None:
+        """
+        with self._lock:
+            sample = self._samples[self._index]
+            sample[TIMESTAMP] = timestamp
+            sample[X] = roi[0]
+            sample[Y] = roi[1]
+            sample[WIDTH] = roi[2]
+            sample[HEIGHT] = roi[3]
+            sample[STATE] = state
+            sample[CORRELATION] = correlation
+            self._index = (self._index + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+
+    def set_last_correlation(self, correlation: float) -> None:
+        with self._lock:
+            if self._count:
+                self._samples[self._index - 1, CORRELATION] = correlation
+
+
+    def _segments(self, since: float | None) -> list[np.ndarray]:
+        """
+        Gets views of the samples newer than the given time in chronological order, must be called with the lock held
+        :param since: wall-clock time, None for all samples
+        :return list[np.ndarray]: one or two views into the buffer
+        """
+        if self._count < self.capacity:
+            segments = [self._samples[:self._count]]
+        else:
+            segments = [self._samples[self._index:], self._samples[:self._index]]
+        if since is None:
+            return [segment for segment in segments if len(segment)]
+        result = []
+        for segment in segments:
+            start = int(np.searchsorted(segment[:, TIMESTAMP], since))
+            if start < len(segment):
+                result.append(segment[start:])
+        return result
+
+
+    def get_samples(self, duration: float | None = None, now: float | None = None) -> np.ndarray:
+        """
+        Gets a copy of the samples of the last given seconds in chronological order
+        :param duration: window length in seconds, None for the whole history
+        :param now: end of the window, the last sample time by default
+        :return np.ndarray: array of shape (n, 7), columns are given by the module level field indices
+        """
+        with self._lock:
+            since = self._window_start(duration, now)
+            segments = self._segments(since)
+            if not segments:
+                return np.empty((0, SAMPLE_FIELDS), dtype=np.float64)
+            return np.concatenate(segments)
+
+
+    def _window_start(self, duration: float | None, now: float | None) -> float | None:
+        if duration is None or self._count == 0:
+            return None
+        if now is None:
+            now = self._samples[self._index - 1, TIMESTAMP]
+        return now - duration
+
+
+    def get_speed(self, duration: float | None = None, state: int | None = None, now: float | None = None) -> float:
+        """
+        Gets the average speed of the ROI center along its path
+        :param state: only samples in this ROIState value are used, all samples by default
+        :return float: pixels per second in stream coordinates, 0 with less than two samples
+        """
+        samples = self.filter_state(self.get_samples(duration, now), state)
+        if len(samples) < 2:
+            return 0.0
+        elapsed = samples[-1, TIMESTAMP] - samples[0, TIMESTAMP]
+        if elapsed <= 0:
+            return 0.0
+        centers_x = samples[:, X] + samples[:, WIDTH] / 2
+        centers_y = samples[:, Y] + samples[:, HEIGHT] / 2
+        distance = np.hypot(np.diff(centers_x), np.diff(centers_y)).sum()
+        return float(distance / elapsed)
+
+
+    def get_path_bounds(self, duration: float | None = None, state: int | None = None,
+                        now: float | None = None) -> tuple[int, int, int, int] | None:
+        """
+        Gets the bounding box covering every ROI of the path
+        :param state: only samples in this ROIState value are used, all samples by default
+        :return tuple[int, int, int, int] | None: x, y, width, height or None without samples
+        """
+        samples = self.filter_state(self.get_samples(duration, now), state)
+        if len(samples) == 0:
+            return None
+        left = samples[:, X].min()
+        top = samples[:, Y].min()
+        right = (samples[:, X] + samples[:, WIDTH]).max()
+        bottom = (samples[:, Y] + samples[:, HEIGHT]).max()
+        return int(left), int(top), int(right - left), int(bottom - top)
+
+
+    @staticmethod
+    def filter_state(samples: np.ndarray, state: int | None) -> np.ndarray:
+        if state is None:
+            return samples
+        return samples[samples[:, STATE] == state]
+
+
+    def get_trail_points(self, since: float, width_ratio: float, height_ratio: float) -> np.ndarray:
+        """
+        Gets the ROI centers newer than the given time scaled to display coordinates.
+        The points are written into a preallocated buffer, the returned view is valid until the next call
+        :param since: wall-clock time of the oldest point
+        :param width_ratio: stream pixels per display pixel horizontally
+        :param height_ratio: stream pixels per display pixel vertically
+        :return np.ndarray: int32 array of shape (n, 2)
+        """
+        with self._lock:
+            count = 0
+            for segment in self._segments(since):
+                end = count + len(segment)
+                centers = self._centers[count:end]
+                np.multiply(segment[:, WIDTH], 0.5, out=centers[:, 0])
+                np.add(centers[:, 0], segment[:, X], out=centers[:, 0])
+                np.multiply(segment[:, HEIGHT], 0.5, out=centers[:, 1])
+                np.add(centers[:, 1], segment[:, Y], out=centers[:, 1])
+                count = end
+            centers = self._centers[:count]
+            centers[:, 0] /= width_ratio
+            centers[:, 1] /= height_ratio
+            points = self._points[:count]
+            np.copyto(points, centers, casting="unsafe")
+            return points
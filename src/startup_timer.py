@@ -0,0 +1,104 @@
+﻿import builtins
+import os
+import sys
+import time
+
+STARTUP_TRACE_OPTION = "--startup-trace"
+STARTUP_TRACE_ENVIRONMENT_VARIABLE = "STREAM_RECEIVER_STARTUP_TRACE"
+
+
+def is_startup_trace_enabled(argv) -> bool:
+    """
+    Checks whether the startup trace is requested by the command line option or the environment variable
+    :param argv: command line arguments
+    :return bool:
+    """
+    return STARTUP_TRACE_OPTION in argv or os.environ.get(STARTUP_TRACE_ENVIRONMENT_VARIABLE, "") not in ("", "0")
+
+
+class ImportTracer:
+    """
+    Measures how long the imports done while it is installed take.
+    Only the outermost import of a module that was not loaded yet is recorded,
+    its time includes everything it imports
+    """
+
+    def __init__(self):
+        self.imports = []
+        self._original_import = None
+        self._depth = 0
+
+
+    def install(self) -> None:
+        if self._original_import is not None:
+            return
+        self._original_import = builtins.__import__
+        builtins.__import__ = self.traced_import
+
+
+    def uninstall(self) -> None:
+        if self._original_import is None:
+            return
+        builtins.__import__ = self._original_import
+        self._original_import = None
+
+
+    def traced_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if self._depth > 0 or level > 0 or name in sys.modules:
+            self._depth += 1
+            try:
+                return self._original_import(name, globals, locals, fromlist, level)
+            finally:
+                self._depth -= 1
+        self._depth += 1
+        start_time = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._depth -= 1
+            self.imports.append((name, time.perf_counter() - start_time))
+
+
+    def summary(self) -> str:
+        lines = [f"Imports took {sum(duration for _, duration in self.imports) * 1000:.0f} ms"]
+        for name, duration in sorted(self.imports, key=lambda item: item[1], reverse=True):
+            lines.append(f"  {name}: {duration * 1000:.1f} ms")
+        return "\n".join(lines)
+
+
+class StartupTimer:
+    """
+    Measures the startup phases, each mark closes the phase that started at the previous mark
+    """
+
+    def __init__(self, start_time: float = None, import_tracer: ImportTracer = None):
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.import_tracer = import_tracer
+        self.last_time = self.start_time
+        self.phases = []
+
+
+    def mark(self, phase: str) -> float:
+        """
+        Closes the current phase
+        :param phase: name of the phase that has just finished
+        :return float: duration of the phase in seconds
+        """
+        now = time.perf_counter()
+        duration = now - self.last_time
+        self.phases.append((phase, duration))
+        self.last_time = now
+        return duration
+
+
+    def get_total_time(self) -> float:
+        return self.last_time - self.start_time
+
+
+    def summary(self) -> str:
+        lines = [f"Startup took {self.get_total_time() * 1000:.0f} ms"]
+        for phase, duration in self.phases:
+            lines.append(f"  {phase}: {duration * 1000:.1f} ms")
+        if self.import_tracer is not None:
+            lines.append(self.import_tracer.summary())
+        return "\n".join(lines)
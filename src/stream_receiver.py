@@ -1,14 +1,18 @@
 ﻿import threading
 import time
 import subprocess
+import re
 import numpy as np
 from pathlib import Path
 
 from PySide6.QtWidgets import QWidget
 from PySide6.QtCore import Signal
 
-from src.tools import DebugEmitter
+from src.tools import DebugEmitter, get_frame_shape, PIX_FMT_RGB24, SUPPORTED_PIX_FMTS
 from src.data import Data
+from src.frame_buffer import FrameRingBuffer, StreamFrame
+from src.av_decoder import AVDecoder
+from src.stream_stats import StreamStats, LINE_PROGRESS, LINE_PROBLEM
 
 MAIN_PATH = Path(__file__).resolve().parent.parent
 
@@ -16,7 +20,21 @@ FFMPEG_PATH = str(MAIN_PATH / "ffmpeg")
 
 INPUT_OPTIONS_FILE_NAME = "ffmpeg_input_options"
 
+DECODER_BACKEND_OPTION = "decoder_backend"
+FFMPEG_BACKEND = "ffmpeg"
+PYAV_BACKEND = "pyav"
+OUTPUT_PIX_FMT_OPTION = "output_pix_fmt"
+SCALE_TO_VIEW_OPTION = "scale_to_view"
+FRAME_STAMP_OPTION = "frame_stamp"
+
+# Options of the receiver itself, they are not passed to ffmpeg
+RECEIVER_OPTIONS = (DECODER_BACKEND_OPTION, OUTPUT_PIX_FMT_OPTION, SCALE_TO_VIEW_OPTION, FRAME_STAMP_OPTION)
+
 default_input_options = {
+    DECODER_BACKEND_OPTION: FFMPEG_BACKEND,
+    OUTPUT_PIX_FMT_OPTION: PIX_FMT_RGB24,
+    SCALE_TO_VIEW_OPTION: False,
+    FRAME_STAMP_OPTION: False,
     "loglevel": "info",
     "fflags": ["nobuffer", "discardcorrupt"],
     "flags": "low_delay",
@@ -27,6 +45,25 @@ default_input_options = {
 
 TIME_OUT = 1
 
+FRAME_SLOT_COUNT = 4
+FRAME_WAIT_TIMEOUT = 0.1
+
+STREAM_PROBE_TIMEOUT = 10
+STDERR_CHUNK_SIZE = 4096
+STDERR_LINE_SEPARATOR = re.compile(rb"[\r\n]")
+
+SUPERVISOR_INTERVAL = 0.2
+FIRST_FRAME_TIMEOUT = 10
+STALL_TIMEOUT = 3
+RESTART_INITIAL_DELAY = 0.5
+RESTART_MAX_DELAY = 8
+DECODER_JOIN_TIMEOUT = 1
+# ffmpeg does not print the stream lines with these log levels, so there is nothing to wait for
+QUIET_LOG_LEVELS = ("quiet", "panic", "fatal", "error", "warning")
+
+STREAM_LINE_PATTERN = re.compile(r"Stream #\d+:\d+.*: Video: .*?[\s,](\d{2,5})x(\d{2,5})(?:[\s,\[]|$)")
+FRAME_CHANGED_PATTERN = re.compile(r"frame changed from size:(\d+)x(\d+).* to size:(\d+)x(\d+)")
+
 
 class StreamSize:
     SIZE_720 = (0, (960, 720))
@@ -37,22 +74,83 @@ class StreamSize:
     SIZE_NONE = (5, (0, 0))
 
 
+class StreamProbe:
+    """
+    Stream geometry of one ffmpeg process parsed from its stderr.
+    The input size is the decoded stream resolution, the output size is the geometry of the frames in the pipe
+    """
+
+    INPUT_SECTION = "input"
+    OUTPUT_SECTION = "output"
+
+    def __init__(self):
+        self.section = None
+        self.input_size = None
+        self.output_size = None
+        self.output_size_event = threading.Event()
+
+
+    def parse_line(self, line: str) -> tuple[int, int] | None:
+        """
+        Parses a stderr line
+        :param line: stripped stderr line
+        :return tuple[int, int] | None: the input size if the line detected or changed it
+        """
+        if line.startswith("Input #"):
+            self.section = self.INPUT_SECTION
+            return None
+        if line.startswith("Output #"):
+            self.section = self.OUTPUT_SECTION
+            return None
+
+        match = FRAME_CHANGED_PATTERN.search(line)
+        if match:
+            self.input_size = (int(match[3]), int(match[4]))
+            return self.input_size
+
+        match = STREAM_LINE_PATTERN.search(line)
+        if match:
+            size = (int(match[1]), int(match[2]))
+            if self.section == self.OUTPUT_SECTION:
+                self.output_size = size
+                self.output_size_event.set()
+            elif self.section == self.INPUT_SECTION:
+                self.input_size = size
+                return size
+        return None
+
+
 class StreamReceiver(QWidget):
 
     change_stream_size_with_index_signal = Signal(int)
+    stream_size_detected_signal = Signal(tuple)
+    stream_stats_signal = Signal(dict)
 
     default_stream_size = StreamSize.SIZE_720[1]
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.ffmpeg_process = None
+        self.av_decoder = None
+        self.url = None
+        self.output_size = None
+
+        self.is_running = False
+        self.supervisor_thread = None
+        self.restart_count = 0
+        self.time_to_first_frame = None
+        self._spawn_time = 0.0
+        self._spawn_sequence = 0
+        self._first_frame_received = False
+        self._stop_event = threading.Event()
+        self._process_lock = threading.RLock()
 
         self.stream_thread = None
         self.err_thread = None
-        self.current_frame = None
+        self.stream_stats = StreamStats()
+        self.frame_buffer = FrameRingBuffer(FRAME_SLOT_COUNT)
         self.stream_width = 0
         self.stream_height = 0
-        self.stream_lock = threading.Lock()
         self.debug = DebugEmitter()
         self.data = Data(self, MAIN_PATH)
 
@@ -62,10 +160,42 @@ class StreamReceiver(QWidget):
             self.input_options = default_input_options
             self.data.save_to_json(INPUT_OPTIONS_FILE_NAME, self.input_options)
 
+        self.decoder_backend = self.input_options.get(DECODER_BACKEND_OPTION, FFMPEG_BACKEND)
+        self.output_pix_fmt = self.input_options.get(OUTPUT_PIX_FMT_OPTION, PIX_FMT_RGB24)
+        if self.output_pix_fmt not in SUPPORTED_PIX_FMTS:
+            self.debug.send(f"Unsupported output pixel format '{self.output_pix_fmt}', using {PIX_FMT_RGB24}")
+            self.output_pix_fmt = PIX_FMT_RGB24
+        self.scale_to_view = bool(self.input_options.get(SCALE_TO_VIEW_OPTION, False))
+        self.frame_stamp = bool(self.input_options.get(FRAME_STAMP_OPTION, False))
+
+
+    def get_input_options(self) -> dict:
+        """
+        Gets the ffmpeg input options without the receiver's own options
+        :return dict:
+        """
+        return {key: value for key, value in self.input_options.items() if key not in RECEIVER_OPTIONS}
+
+
+    def get_av_options(self) -> dict:
+        """
+        Gets the ffmpeg input options as PyAV demuxer and codec options, list values become flag sets
+        :return dict:
+        """
+        av_options = {}
+        for key, value in self.get_input_options().items():
+            if key == "loglevel":
+                continue
+            if isinstance(value, list):
+                av_options[key] = "+".join(str(v) for v in value)
+            else:
+                av_options[key] = str(value)
+        return av_options
+
 
     def get_ffmpeg_args(self, url):
         input_options_args = []
-        for key, value in self.input_options.items():
+        for key, value in self.get_input_options().items():
             if isinstance(value, list):
                 for i in range(len(value)):
                     input_options_args.append(f"-{key}")
@@ -74,12 +204,17 @@ class StreamReceiver(QWidget):
                 input_options_args.append(f"-{key}")
                 input_options_args.append(str(value))
 
+        output_options_args = []
+        if self.output_size is not None:
+            output_options_args = ["-vf", f"scale={self.output_size[0]}:{self.output_size[1]}:flags=fast_bilinear"]
+
         args = [
             FFMPEG_PATH,
             *input_options_args,
             "-i", url,
+            *output_options_args,
             "-f", "rawvideo",
-            "-pix_fmt", "rgb24",
+            "-pix_fmt", self.output_pix_fmt,
             "pipe:"
         ]
 
@@ -99,74 +234,297 @@ class StreamReceiver(QWidget):
         self.debug.send(f"Stream resolution is set to {size}")
 
 
+    def set_output_size(self, size) -> None:
+        """
+        Sets the size the decoder scales frames to, the ffmpeg process is restarted to apply it
+        :param size: tuple with even width and height or None for the full stream resolution
+        :return None:
+        """
+        if size is not None and tuple(size) == self.get_stream_size():
+            size = None
+        if size == self.output_size:
+            return
+        self.output_size = tuple(size) if size is not None else None
+        self.debug.send(f"Stream output size is set to {self.output_size or 'full resolution'}")
+        if self.av_decoder:
+            self.av_decoder.output_size = self.output_size
+        elif self.ffmpeg_process:
+            self.restart()
+
+
+    def get_output_size(self) -> tuple[int, int]:
+        """
+        Gets the size of the frames the decoder outputs
+        :return tuple[int, int]:
+        """
+        if self.output_size is not None:
+            return self.output_size
+        return self.stream_width, self.stream_height
+
+
     def start(self, url: str) -> None:
         """
-        Starts receiving ffmpeg stream on given url
+        Starts receiving ffmpeg stream on given url, the supervisor keeps it running until stop is called
         :param url:
         :return None:
         """
-
-        args = self.get_ffmpeg_args(url)
-        self.debug.send(args)
-        self.ffmpeg_process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=subprocess.CREATE_NO_WINDOW)
-        self.stream_thread = threading.Thread(target=self.read_stream, daemon=True)
-        self.stream_thread.start()
-        self.err_thread = threading.Thread(target=self.monitor_stderr, daemon=True)
-        self.err_thread.start()
+        self.url = url
+        self.is_running = True
+        self.restart_count = 0
+        self.time_to_first_frame = None
+        self.stream_stats.reset()
+        self._stop_event.clear()
+        self.spawn()
+        if self.supervisor_thread is None or not self.supervisor_thread.is_alive():
+            self.supervisor_thread = threading.Thread(target=self.supervise, daemon=True)
+            self.supervisor_thread.start()
+
+
+    def spawn(self) -> None:
+        """
+        Starts the decoder backend on the current url, nothing is started once the receiver is stopped
+        :return None:
+        """
+        with self._process_lock:
+            # stop() may have run after the supervisor decided to restart, its terminate() takes this lock
+            if self._stop_event.is_set() or not self.is_running:
+                return
+            self._spawn_time = time.monotonic()
+            self._spawn_sequence = self.frame_buffer.sequence
+            self._first_frame_received = False
+            if self.decoder_backend == PYAV_BACKEND:
+                if AVDecoder.is_available():
+                    self.av_decoder = AVDecoder(self.frame_buffer, self.get_av_options(), self.output_pix_fmt,
+                                                self.on_stream_size_detected)
+                    self.av_decoder.output_size = self.output_size
+                    self.av_decoder.start(self.url)
+                    return
+                self.debug.send("PyAV is not installed, falling back to the ffmpeg decoder")
+
+            args = self.get_ffmpeg_args(self.url)
+            self.debug.send(args)
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=subprocess.CREATE_NO_WINDOW)
+            probe = StreamProbe()
+            self.ffmpeg_process = process
+            self.stream_thread = threading.Thread(target=self.read_stream, args=(process, probe), daemon=True)
+            self.stream_thread.start()
+            self.err_thread = threading.Thread(target=self.monitor_stderr, args=(process, probe), daemon=True)
+            self.err_thread.start()
+
+
+    def terminate(self) -> None:
+        """
+        Stops the decoder backend, the last frame stays available
+        :return None:
+        """
+        with self._process_lock:
+            if self.av_decoder:
+                self.av_decoder.stop()
+                if not self.av_decoder.join(DECODER_JOIN_TIMEOUT):
+                    self.debug.send("PyAV decoder did not stop in time, it exits after the current read")
+                self.av_decoder = None
+            if self.ffmpeg_process:
+                self.ffmpeg_process.kill()
+                self.ffmpeg_process = None
+
+
+    def restart(self) -> None:
+        """
+        Restarts the stream on the last url, the last frame stays available meanwhile
+        :return None:
+        """
+        if self.url is None or not self.is_running:
+            return
+        with self._process_lock:
+            self.terminate()
+            self.spawn()
 
 
     def stop(self) -> None:
         """
-        Stops the ffmpeg stream
+        Stops the ffmpeg stream and its supervisor
         :return None:
         """
-        if self.ffmpeg_process:
-            self.ffmpeg_process.kill()
-            self.ffmpeg_process = None
+        self.is_running = False
+        self._stop_event.set()
+        self.terminate()
+
+
+    def supervise(self) -> None:
+        """
+        Restarts the decoder when it exits, stalls or reads a broken frame.
+        Restarts are delayed with a capped exponential backoff that is reset once frames flow again
+        :return None:
+        """
+        delay = RESTART_INITIAL_DELAY
+        while not self._stop_event.wait(SUPERVISOR_INTERVAL):
+            failure = self.check_health()
+            if failure is None:
+                if self._first_frame_received:
+                    delay = RESTART_INITIAL_DELAY
+                continue
+
+            self.debug.send(f"Stream failed: {failure}, restarting in {delay:.1f} s")
+            self.terminate()
+            if self._stop_event.wait(delay):
+                break
+            self.restart_count += 1
+            self.spawn()
+            delay = min(delay * 2, RESTART_MAX_DELAY)
+        self.debug.send("Stream supervisor stopped")
+
+
+    def check_health(self) -> str | None:
+        """
+        Checks the running decoder, also records the time to the first frame after a (re)start
+        :return str | None: the failure reason or None if the stream is healthy
+        """
+        with self._process_lock:
+            now = time.monotonic()
+            if not self._first_frame_received and self.frame_buffer.sequence > self._spawn_sequence:
+                self._first_frame_received = True
+                self.time_to_first_frame = self.frame_buffer.last_publish_time - self._spawn_time
+                self.debug.send(f"First frame after {self.time_to_first_frame:.2f} s, restarts: {self.restart_count}")
+
+            if self.av_decoder is not None:
+                if self.av_decoder.decode_thread is None or not self.av_decoder.decode_thread.is_alive():
+                    return "decoder stopped"
+            else:
+                process = self.ffmpeg_process
+                if process is None or process.poll() is not None:
+                    return "ffmpeg exited"
+                if self.stream_thread is not None and not self.stream_thread.is_alive():
+                    return "broken frame"
+
+            if self._first_frame_received:
+                if now - max(self.frame_buffer.last_publish_time, self._spawn_time) > STALL_TIMEOUT:
+                    return f"no frames for {STALL_TIMEOUT} s"
+            elif now - self._spawn_time > FIRST_FRAME_TIMEOUT:
+                return f"no first frame in {FIRST_FRAME_TIMEOUT} s"
+            return None
+
+
+    def get_supervisor_stats(self) -> dict:
+        """
+        Gets the restart count and the time to the first frame after the last (re)start
+        :return dict:
+        """
+        return {
+            "restart_count": self.restart_count,
+            "time_to_first_frame": self.time_to_first_frame
+        }
 
 
-    def monitor_stderr(self) -> None:
+    def monitor_stderr(self, process, probe: StreamProbe) -> None:
         """
-        Displays in debug window stderr messages
+        Parses stderr of the ffmpeg process into the stream stats and probes the stream geometry from it.
+        Only warnings, errors and the stream description are shown in debug window
+        :param process: ffmpeg process
+        :param probe: geometry probe of the process
         :return None:
         """
         try:
-            while self.ffmpeg_process is not None:
-                line = self.ffmpeg_process.stderr.readline()
-                if not line:
-                    self.debug.send("stderr: EOF reached")
-                    break
-                self.debug.send(f"stderr: {line.decode().strip()}")
+            for raw_line in self.read_stderr_lines(process.stderr):
+                line = raw_line.decode(errors="replace").strip()
+                input_size = probe.parse_line(line)
+                if input_size is not None and self.ffmpeg_process is process:
+                    self.on_stream_size_detected(input_size)
+                line_type = self.stream_stats.parse_line(line)
+                if line_type == LINE_PROGRESS:
+                    self.stream_stats_signal.emit(self.stream_stats.as_dict())
+                elif line_type == LINE_PROBLEM or line.startswith(("Input #", "Output #", "Stream #")):
+                    self.debug.send(f"stderr: {line}")
+            self.debug.send("stderr: EOF reached")
             self.debug.send("stderr thread stopped")
         except Exception as e:
             self.debug.send(f"Monitoring stderr was failed: {e}")
+        finally:
+            probe.output_size_event.set()
+
+
+    @staticmethod
+    def read_stderr_lines(pipe):
+        """
+        Yields stderr lines split on both line feeds and carriage returns, ffmpeg ends progress lines with the latter
+        :param pipe: binary buffered pipe
+        :return: generator of non-empty lines
+        """
+        pending = b""
+        while True:
+            chunk = pipe.read1(STDERR_CHUNK_SIZE)
+            if not chunk:
+                if pending:
+                    yield pending
+                return
+            *lines, pending = STDERR_LINE_SEPARATOR.split(pending + chunk)
+            for line in lines:
+                if line:
+                    yield line
+
+
+    def get_stream_stats(self) -> dict:
+        """
+        Gets the stream stats parsed from ffmpeg stderr
+        :return dict:
+        """
+        return self.stream_stats.as_dict()
+
+
+    def on_stream_size_detected(self, size) -> None:
+        """
+        Follows the decoded stream resolution. The pipe geometry of a running process never changes,
+        ffmpeg scales frames of a changed resolution to it, so the stream keeps running
+        :param size: decoded width and height
+        :return None:
+        """
+        if size == self.get_stream_size():
+            return
+        self.debug.send(f"Detected stream resolution {size}, expected {self.get_stream_size()}")
+        self.set_stream_size(size)
+        self.stream_size_detected_signal.emit(size)
+
+
+    def probe_output_size(self, probe: StreamProbe) -> tuple[int, int]:
+        """
+        Waits until ffmpeg reports the geometry of the frames it writes to the pipe
+        :param probe: geometry probe of the process
+        :return tuple[int, int]: the probed size or the expected one if it was not reported in time
+        """
+        if str(self.input_options.get("loglevel", "info")) not in QUIET_LOG_LEVELS:
+            if probe.output_size_event.wait(STREAM_PROBE_TIMEOUT) and probe.output_size is not None:
+                return probe.output_size
+            self.debug.send("Stream geometry was not reported by ffmpeg, using the expected size")
+        return self.get_output_size()
 
 
-    def read_stream(self) -> None:
+    def read_stream(self, process, probe: StreamProbe) -> None:
         """
-        Reads the stream pipe then saving the current frame
+        Reads the stream pipe straight into the frame ring buffer slots then publishing them.
+        The reads are sized from the probed pipe geometry.
+        Exits when the process is stopped or replaced by a restart
+        :param process: ffmpeg process
+        :param probe: geometry probe of the process
         :return None:
         """
-        if self.stream_width == 0 or self.stream_height == 0:
+        width, height = self.probe_output_size(probe)
+        if self.ffmpeg_process is not process:
+            return
+        if width == 0 or height == 0:
             self.debug.send("Stream size was not set, exiting...")
             self.stop()
-        while True:
+            return
+        shape = get_frame_shape(width, height, self.output_pix_fmt)
+        while self.ffmpeg_process is process:
             try:
-                if self.ffmpeg_process:
-                    data_size = self.stream_width * self.stream_height * 3
-                    raw_frame = self.ffmpeg_process.stdout.read(data_size)
-                    self.ffmpeg_process.stdout.flush()
+                self.frame_buffer.configure(shape, self.output_pix_fmt)
+                slot = self.frame_buffer.next_slot()
 
-                    if raw_frame is None or len(raw_frame) != data_size:
+                if not self.read_frame_into(process.stdout, slot.data):
+                    if self.ffmpeg_process is process:
                         self.debug.send("Raw frame is empty or broken, exiting...")
-                        self.stop()
-                        break
-
-                    with self.stream_lock:
-                        self.current_frame = np.frombuffer(raw_frame, dtype=np.uint8).reshape(
-                            [self.stream_height, self.stream_width, 3])
-                else:
-                    time.sleep(0.1)
+                    break
+
+                self.frame_buffer.publish(slot)
             except subprocess.SubprocessError as e:
                 self.debug.send(f"Subprocess error: {e}")
                 time.sleep(TIME_OUT)
@@ -177,13 +535,75 @@ class StreamReceiver(QWidget):
                 break
 
 
+    @staticmethod
+    def read_frame_into(pipe, frame: np.ndarray) -> bool:
+        """
+        Fills the frame buffer from the pipe without allocating intermediate bytes
+        :param pipe: binary pipe supporting readinto
+        :param frame: C-contiguous writable frame buffer
+        :return bool: False if the pipe ended before the frame was complete
+        """
+        view = memoryview(frame).cast("B")
+        size = view.nbytes
+        received = 0
+        while received < size:
+            count = pipe.readinto(view[received:])
+            if not count:
+                return False
+            received += count
+        return True
+
+
     def get_current_frame(self) -> np.ndarray:
         """
-        Gets the current frame
+        Gets the current frame. The array is a ring buffer slot, it is overwritten
+        after FRAME_SLOT_COUNT - 1 newer frames, copy it to keep it longer
         :return:
         """
-        with self.stream_lock:
-            return self.current_frame
+        slot = self.frame_buffer.get_latest()
+        return slot.data if slot is not None else None
+
+
+    def get_current_slot(self) -> StreamFrame | None:
+        """
+        Gets the slot holding the current frame together with its sequence number
+        :return StreamFrame | None:
+        """
+        return self.frame_buffer.get_latest()
+
+
+    def get_pix_fmt(self) -> str:
+        return self.output_pix_fmt
+
+
+    def get_decode_time(self) -> tuple[float, float] | None:
+        """
+        Gets the decode time of the last frame and its smoothed average in seconds,
+        only the in-process decoder measures it
+        :return tuple[float, float] | None: None when no frame was decoded in process
+        """
+        av_decoder = self.av_decoder
+        if av_decoder is None or av_decoder.decoded_frames_count == 0:
+            return None
+        return av_decoder.last_decode_time, av_decoder.average_decode_time
+
+
+    def get_frame_sequence(self) -> int:
+        """
+        Gets the sequence number of the latest published frame
+        :return int:
+        """
+        return self.frame_buffer.sequence
+
+
+    def wait_for_frame(self, last_sequence: int, timeout: float = FRAME_WAIT_TIMEOUT) -> StreamFrame | None:
+        """
+        Waits until a frame newer than last_sequence arrives
+        :param last_sequence: sequence number of the last handled frame
+        :param timeout: seconds to wait
+        :return StreamFrame | None: slot of the new frame or None on timeout
+        """
+        return self.frame_buffer.wait_for_frame(last_sequence, timeout)
 
 
     def change_stream_size_with_index(self, index) -> None:
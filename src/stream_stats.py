@@ -0,0 +1,109 @@
+﻿import re
+import threading
+
+PROGRESS_PATTERN = re.compile(r"(\w+)=\s*(\S+)")
+NUMBER_PATTERN = re.compile(r"[-+]?\d*\.?\d+")
+
+LINE_PROGRESS = "progress"
+LINE_PROBLEM = "problem"
+LINE_INFO = "info"
+
+DECODE_ERROR_KEYWORDS = ("error while decoding", "concealing", "decode_slice_header error", "no frame!",
+                         "invalid nal unit", "missing picture", "non-existing pps", "illegal short term buffer")
+CORRUPT_KEYWORDS = ("corrupt",)
+PROBLEM_KEYWORDS = ("error", "warning", "invalid", "failed", "missing", "overrun", "lost", "discard", "non-existing")
+
+
+class StreamStats:
+    """
+    Stream health parsed from the ffmpeg stderr: progress values (fps, bitrate, dropped and duplicated frames)
+    and counters of decode errors, corrupt packets and other warnings
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self.frame = 0
+            self.fps = 0.0
+            self.bitrate = None
+            self.speed = None
+            self.dropped_frames = 0
+            self.duplicated_frames = 0
+            self.decode_errors = 0
+            self.corrupt_packets = 0
+            self.warnings = 0
+            self.last_problem = None
+
+
+    def parse_line(self, line: str) -> str:
+        """
+        Updates the stats from a stderr line
+        :param line: stripped stderr line
+        :return str: LINE_PROGRESS, LINE_PROBLEM if the line is a warning or an error, otherwise LINE_INFO
+        """
+        if line.startswith("frame=") or (line.startswith("size=") and "time=" in line):
+            self.parse_progress(line)
+            return LINE_PROGRESS
+
+        lower_line = line.lower()
+        with self._lock:
+            if any(keyword in lower_line for keyword in CORRUPT_KEYWORDS):
+                self.corrupt_packets += 1
+            elif any(keyword in lower_line for keyword in DECODE_ERROR_KEYWORDS):
+                self.decode_errors += 1
+            elif any(keyword in lower_line for keyword in PROBLEM_KEYWORDS):
+                self.warnings += 1
+            else:
+                return LINE_INFO
+            self.last_problem = line
+        return LINE_PROBLEM
+
+
+    def parse_progress(self, line: str) -> None:
+        """
+        Parses a progress line like "frame= 120 fps= 30 q=-0.0 size=N/A time=00:00:04.00 bitrate=N/A dup=0 drop=2 speed=1x"
+        :param line:
+        :return None:
+        """
+        values = dict(PROGRESS_PATTERN.findall(line))
+        with self._lock:
+            self.frame = self.to_number(values.get("frame"), int, self.frame)
+            self.fps = self.to_number(values.get("fps"), float, self.fps)
+            self.bitrate = self.to_number(values.get("bitrate"), float, None)
+            self.speed = self.to_number(values.get("speed"), float, None)
+            self.duplicated_frames = self.to_number(values.get("dup"), int, self.duplicated_frames)
+            self.dropped_frames = self.to_number(values.get("drop"), int, self.dropped_frames)
+
+
+    @staticmethod
+    def to_number(value, number_type, default):
+        if value is None:
+            return default
+        match = NUMBER_PATTERN.search(value)
+        if match is None:
+            return default
+        return number_type(float(match.group()))
+
+
+    def as_dict(self) -> dict:
+        """
+        Gets a snapshot of the stats
+        :return dict:
+        """
+        with self._lock:
+            return {
+                "frame": self.frame,
+                "fps": self.fps,
+                "bitrate": self.bitrate,
+                "speed": self.speed,
+                "dropped_frames": self.dropped_frames,
+                "duplicated_frames": self.duplicated_frames,
+                "decode_errors": self.decode_errors,
+                "corrupt_packets": self.corrupt_packets,
+                "warnings": self.warnings,
+                "last_problem": self.last_problem
+            }
@@ -1,6 +1,7 @@
 ﻿import os
 import sys
 import numpy as np
+import cv2
 from PySide6.QtGui import QPixmap, QImage
 from PySide6.QtCore import Qt, Signal, QObject
 import logging
@@ -8,9 +9,18 @@ import inspect
 from pathlib import Path
 import datetime
 import time
+import functools
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+PIX_FMT_RGB24 = "rgb24"
+PIX_FMT_YUV420P = "yuv420p"
+PIX_FMT_GRAY = "gray"
+
+SUPPORTED_PIX_FMTS = (PIX_FMT_RGB24, PIX_FMT_YUV420P, PIX_FMT_GRAY)
+
+LUT_CACHE_SIZE = 256
+
 def numpy_to_pixmap(array: np.ndarray, color="rgb24") -> QPixmap:
     """
     Returns a QPixmap from a numpy array.
@@ -49,7 +59,214 @@ def scale_pixmap(pixmap, size) -> QPixmap:
     return pixmap.scaled(size, Qt.KeepAspectRatio, Qt.FastTransformation)
 
 
+def numpy_to_scaled_image(array: np.ndarray, size) -> QImage:
+    """
+    Returns a QImage from an rgb24 numpy array scaled to fit a given size.
+    The image owns its pixels, so it can be painted on and outlives the array.
+    :param array: C-contiguous rgb24 numpy image
+    :param size: QSize to fit the image into keeping the aspect ratio
+    :return QImage: scaled QImage image
+    """
+    h, w, ch = array.shape
+    image = QImage(array, w, h, ch * w, QImage.Format_RGB888)
+    scaled = image.scaled(size, Qt.KeepAspectRatio, Qt.FastTransformation)
+    if scaled.size() == image.size():
+        # Qt returns an image sharing the array memory when there is nothing to scale
+        scaled = image.copy()
+    return scaled
+
+
+def get_frame_shape(width, height, pix_fmt=PIX_FMT_RGB24) -> tuple:
+    """
+    Returns the numpy shape of a raw frame in the given pixel format.
+    :param width: frame width
+    :param height: frame height
+    :param pix_fmt: ffmpeg pixel format name
+    :return tuple: numpy shape
+    """
+    if pix_fmt == PIX_FMT_RGB24:
+        return height, width, 3
+    elif pix_fmt == PIX_FMT_GRAY:
+        return height, width
+    elif pix_fmt == PIX_FMT_YUV420P:
+        return height * 3 // 2, width
+    raise ValueError(f"Unsupported pixel format: {pix_fmt}")
+
+
+def get_frame_size(frame: np.ndarray, pix_fmt=PIX_FMT_RGB24) -> tuple[int, int]:
+    """
+    Returns the picture size of a raw frame in the given pixel format.
+    :param frame: raw frame
+    :param pix_fmt: ffmpeg pixel format name
+    :return tuple: width and height
+    """
+    if pix_fmt == PIX_FMT_YUV420P:
+        return frame.shape[1], frame.shape[0] * 2 // 3
+    return frame.shape[1], frame.shape[0]
+
+
+def fit_size(size, bounds) -> tuple[int, int]:
+    """
+    Returns the largest even size with the aspect ratio of size that fits into bounds without upscaling.
+    :param size: tuple with width and height
+    :param bounds: tuple with maximum width and height
+    :return tuple: width and height
+    """
+    width, height = size
+    scale = min(bounds[0] / width, bounds[1] / height, 1.0)
+    return max(2, int(width * scale) & ~1), max(2, int(height * scale) & ~1)
+
+
+def split_yuv420p(frame: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns views of the Y, U and V planes of a yuv420p frame.
+    :param frame: raw yuv420p frame
+    :return tuple: Y, U and V planes
+    """
+    width, height = get_frame_size(frame, PIX_FMT_YUV420P)
+    flat = frame.reshape(-1)
+    luma_size = width * height
+    chroma_size = luma_size // 4
+    y = flat[:luma_size].reshape(height, width)
+    u = flat[luma_size:luma_size + chroma_size].reshape(height // 2, width // 2)
+    v = flat[luma_size + chroma_size:luma_size + 2 * chroma_size].reshape(height // 2, width // 2)
+    return y, u, v
+
+
+def merge_yuv420p(y: np.ndarray, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """
+    Packs Y, U and V planes into a single yuv420p frame.
+    :return np.ndarray: raw yuv420p frame
+    """
+    height, width = y.shape
+    frame = np.empty(get_frame_shape(width, height, PIX_FMT_YUV420P), dtype=np.uint8)
+    flat = frame.reshape(-1)
+    luma_size = width * height
+    chroma_size = u.size
+    flat[:luma_size] = y.reshape(-1)
+    flat[luma_size:luma_size + chroma_size] = u.reshape(-1)
+    flat[luma_size + chroma_size:] = v.reshape(-1)
+    return frame
+
+
+def frame_to_rgb(frame: np.ndarray, pix_fmt=PIX_FMT_RGB24, size=None) -> np.ndarray:
+    """
+    Converts a raw frame to rgb24. The frame is resized first, so only the pixels that are displayed get converted.
+    rgb24 frames are returned as is.
+    :param frame: raw frame
+    :param pix_fmt: ffmpeg pixel format name
+    :param size: optional tuple with even width and height to convert to
+    :return np.ndarray: rgb24 frame
+    """
+    if pix_fmt == PIX_FMT_RGB24:
+        return frame
+    if size is not None and size == get_frame_size(frame, pix_fmt):
+        size = None
+    if pix_fmt == PIX_FMT_GRAY:
+        if size is not None:
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_NEAREST)
+        return cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+    elif pix_fmt == PIX_FMT_YUV420P:
+        if size is not None:
+            y, u, v = split_yuv420p(frame)
+            chroma_size = (size[0] // 2, size[1] // 2)
+            frame = merge_yuv420p(
+                cv2.resize(y, size, interpolation=cv2.INTER_NEAREST),
+                cv2.resize(u, chroma_size, interpolation=cv2.INTER_NEAREST),
+                cv2.resize(v, chroma_size, interpolation=cv2.INTER_NEAREST))
+        return cv2.cvtColor(frame, cv2.COLOR_YUV2RGB_I420)
+    raise ValueError(f"Unsupported pixel format: {pix_fmt}")
+
+
+def crop_frame_to_rgb(frame: np.ndarray, pix_fmt, x, y, width, height) -> np.ndarray:
+    """
+    Crops a raw frame and converts only the crop to a C-contiguous rgb24 array.
+    The crop is clipped by the frame borders, so it can be smaller than requested.
+    :param frame: raw frame
+    :param pix_fmt: ffmpeg pixel format name
+    :return np.ndarray: rgb24 crop
+    """
+    x, y = max(0, x), max(0, y)
+    if pix_fmt == PIX_FMT_RGB24:
+        return np.array(frame[y:y + height, x:x + width, :], order='C')
+    elif pix_fmt == PIX_FMT_GRAY:
+        return cv2.cvtColor(np.ascontiguousarray(frame[y:y + height, x:x + width]), cv2.COLOR_GRAY2RGB)
+    elif pix_fmt == PIX_FMT_YUV420P:
+        frame_width, frame_height = get_frame_size(frame, pix_fmt)
+        x0, y0 = x & ~1, y & ~1
+        x1 = min(frame_width, (x + width + 1) & ~1)
+        y1 = min(frame_height, (y + height + 1) & ~1)
+        if x1 <= x0 or y1 <= y0:
+            return np.empty((0, 0, 3), dtype=np.uint8)
+        luma, u, v = split_yuv420p(frame)
+        crop = merge_yuv420p(
+            luma[y0:y1, x0:x1],
+            u[y0 // 2:y1 // 2, x0 // 2:x1 // 2],
+            v[y0 // 2:y1 // 2, x0 // 2:x1 // 2])
+        rgb = cv2.cvtColor(crop, cv2.COLOR_YUV2RGB_I420)
+        return np.ascontiguousarray(rgb[y - y0:y - y0 + height, x - x0:x - x0 + width])
+    raise ValueError(f"Unsupported pixel format: {pix_fmt}")
+
+
+def crop_frame_to_gray(frame: np.ndarray, pix_fmt, x, y, width, height) -> np.ndarray:
+    """
+    Crops a raw frame and converts only the crop to a C-contiguous grayscale array.
+    yuv420p frames use the luma plane without any conversion.
+    The crop is clipped by the frame borders, so it can be smaller than requested.
+    :param frame: raw frame
+    :param pix_fmt: ffmpeg pixel format name
+    :return np.ndarray: grayscale crop
+    """
+    x, y = max(0, x), max(0, y)
+    if pix_fmt == PIX_FMT_RGB24:
+        crop = frame[y:y + height, x:x + width, :]
+        if crop.size == 0:
+            return np.empty((0, 0), dtype=np.uint8)
+        return cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_RGB2GRAY)
+    elif pix_fmt == PIX_FMT_GRAY:
+        return np.array(frame[y:y + height, x:x + width], order='C')
+    elif pix_fmt == PIX_FMT_YUV420P:
+        luma, _, _ = split_yuv420p(frame)
+        return np.array(luma[y:y + height, x:x + width], order='C')
+    raise ValueError(f"Unsupported pixel format: {pix_fmt}")
+
+
+@functools.lru_cache(maxsize=LUT_CACHE_SIZE)
+def get_brightness_contrast_lut(brightness: float, contrast: float) -> np.ndarray:
+    """
+    Returns a lookup table applying contrast and brightness to 8-bit values: clip(contrast * v + brightness).
+    Tables are cached and read-only.
+    :param brightness: offset as a fraction of the full range
+    :param contrast: gain
+    :return np.ndarray: 256 uint8 values
+    """
+    values = np.arange(256, dtype=np.float32) / 255.0
+    lut = np.clip((contrast * values + brightness) * 255.0, 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+@functools.lru_cache(maxsize=LUT_CACHE_SIZE)
+def get_log_contrast_lut(max_value: int) -> np.ndarray:
+    """
+    Returns a lookup table of the log transform log(v + 1) normalized so max_value maps to 255.
+    Tables are cached and read-only.
+    :param max_value: the largest value of the image, greater than 0
+    :return np.ndarray: 256 uint8 values
+    """
+    values = np.log(np.arange(256, dtype=np.float64) + 1)
+    lut = np.clip(values / np.log(max_value + 1) * 255, 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
 def increase_grayscale_contrast(image, c = 1.0) -> np.ndarray:
+    if image.dtype == np.uint8 and c > 0:
+        # c * log(v + 1) normalized by its maximum does not depend on c, so one table per image maximum is enough
+        max_value = int(np.max(image)) if image.size else 0
+        if max_value == 0:
+            return np.zeros_like(image)
+        return cv2.LUT(image, get_log_contrast_lut(max_value))
     transformed_image = c * np.log(image + 1)
     max_value = np.max(transformed_image)
     if max_value > 0:
@@ -99,8 +316,8 @@ class DebugEmitter(QObject):
     def send(self, msg: str) -> None:
         try:
             self.debug_signal.emit(msg)
-            frame = inspect.stack()[1]
-            log_message = f"{os.path.basename(frame.filename)}:{frame.lineno} - {msg}"
+            frame = inspect.currentframe().f_back
+            log_message = f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} - {msg}"
             with self.debug_file.open("a") as file:
                 current_datetime = datetime.datetime.now().strftime("%X")
                 file.write(f"{current_datetime}: {log_message}\n")
@@ -7,12 +7,13 @@ from PySide6.QtGui import QPixmap
 
 from src.tools import numpy_to_pixmap, DebugEmitter, get_base_path
 from src.stream_receiver import StreamReceiver
+from src.frame_buffer import StreamFrame, FrameMailbox
+from src.frame_source import FrameSource, StreamFrameSource, CameraFrameSource
+from src.latency import FrameLatencyMonitor
 
 import threading
-import numpy as np
 import time
 import sys
-import cv2
 from pathlib import Path
 
 base_path = get_base_path(__file__)
@@ -20,9 +21,27 @@ base_path = get_base_path(__file__)
 NO_CONNECTION_IMAGE = base_path / "img" / "no_connection.png"
 CONNECTION_ESTABLISHED_IMAGE = base_path / "img" / "connection_established.png"
 
+class RenderedFrame:
+    """
+    A frame together with the images rendered from it off the GUI thread.
+    The frame is a reused buffer slot, so the values needed once it is displayed are copied on the view thread
+    """
+    __slots__ = ("frame", "view_image", "roi_image", "roi_crop_failed", "receive_time", "pts", "stamp")
+
+    def __init__(self, frame: StreamFrame, view_image=None, roi_image=None, roi_crop_failed=False):
+        self.frame = frame
+        self.view_image = view_image
+        self.roi_image = roi_image
+        self.roi_crop_failed = roi_crop_failed
+        self.receive_time = frame.receive_time
+        self.pts = frame.pts
+        self.stamp = None
+
+
 class Viewer(QWidget):
 
-    frame_ready_signal = Signal(np.ndarray)
+    frame_ready_signal = Signal()
+    source_frame_size_signal = Signal(tuple)
     play_pressed_signal = Signal()
     stop_pressed_signal = Signal()
 
@@ -36,23 +55,20 @@ class Viewer(QWidget):
         self.stream_receiver = stream_receiver
         self.is_playing = False
         self.stream_url = None
-        self.tracking_frame_size = (0, 0)
-        self.black_frame = None
 
         self.debug = DebugEmitter()
 
         self.load_no_connection_view()
 
         self.frame_rate = frame_rate
-        self.frame_time = 1.0 / frame_rate
+        self.frame_mailbox = FrameMailbox()
+        self.latency_monitor = FrameLatencyMonitor(stream_receiver.frame_stamp if stream_receiver else False)
 
-        try:
-            self.system_camera = cv2.VideoCapture(0)
-            if self.system_camera.isOpened() and self.system_camera.get(cv2.CAP_PROP_FPS) < 1:
-                raise Exception("System camera is not working")
-        except Exception as e:
-            self.debug.send(f"Error initializing system camera: {e}")
-            self.system_camera = None
+        self.stream_source = StreamFrameSource(stream_receiver) if stream_receiver else None
+        self.camera_source = CameraFrameSource(frame_rate)
+        self.offline_source = None
+        self.source = None
+        self.frame_renderer = None
 
         self._is_playing_lock = threading.Lock()
 
@@ -81,12 +97,51 @@ class Viewer(QWidget):
 
     def set_frame_rate(self, frame_rate) -> None:
         self.frame_rate = frame_rate
-        self.frame_time = 1 / frame_rate
+        self.camera_source.set_frame_rate(frame_rate)
+
+
+    def set_frame_renderer(self, frame_renderer: Callable[[StreamFrame], RenderedFrame] | None) -> None:
+        """
+        Sets the callback that renders every frame on the view thread before it is handed to the GUI
+        :param frame_renderer: callback returning the rendered frame, it must not touch widgets
+        :return None:
+        """
+        self.frame_renderer = frame_renderer
+
+
+    def set_offline_source(self, source: FrameSource | None) -> None:
+        """
+        Sets a recorded or synthetic source that is played instead of the stream and the system camera
+        :param source: frame source or None to go back to the checkbox selection
+        :return None:
+        """
+        self.offline_source = source
 
 
-    def update_frame(self, update_callback: Callable) -> None:
+    def select_source(self) -> FrameSource | None:
         """
-        Updates the view from the callback by sending signal with current frame
+        Selects the source to play: the offline source if it is set, otherwise the stream or the system camera
+        depending on the checked image checkbox
+        :return FrameSource | None:
+        """
+        if self.offline_source is not None:
+            return self.offline_source
+        if self.ui.stream_check_box.isChecked() and self.stream_source is not None:
+            self.stream_source.set_url(self.stream_url)
+            return self.stream_source
+        if self.ui.transmitter_check_box.isChecked():
+            return self.camera_source
+        return None
+
+
+    def update_frame(self, next_frame_callback: Callable[[int], StreamFrame | None], last_sequence=0) -> None:
+        """
+        Updates the view by rendering every new frame and posting it to the mailbox exactly once.
+        Rendering runs here, on the view thread, so the GUI thread only has to show the images.
+        The signal is sent only when the GUI has taken the previous frame, otherwise the frame replaces it.
+        The callback blocks until a frame newer than the given sequence number is available
+        or returns None when it timed out, frames that arrive while one is rendered are skipped
+        :param last_sequence: frames up to this sequence number are skipped
         :return None:
         """
         while True:
@@ -94,46 +149,47 @@ class Viewer(QWidget):
                 is_playing = self.is_playing
             if not is_playing:
                 break
-            start_time = time.time()
             try:
-                frame = update_callback()
+                frame = next_frame_callback(last_sequence)
                 if frame is None:
                     continue
-                self.current_frame = frame
-                self.frame_ready_signal.emit(frame)
+                last_sequence = frame.sequence
+                self.current_frame = frame.data
+                frame_renderer = self.frame_renderer
+                rendered_frame = frame_renderer(frame) if frame_renderer is not None else RenderedFrame(frame)
+                rendered_frame.stamp = self.latency_monitor.read_stamp(frame)
+                with self._is_playing_lock:
+                    if not self.is_playing:
+                        break
+                    if self.frame_mailbox.post(rendered_frame):
+                        self.frame_ready_signal.emit()
             except Exception as e:
                 self.debug.send(f"Error updating view: {e}")
 
-            elapsed_time = time.time() - start_time
-            if elapsed_time < self.frame_time:
-                time.sleep(self.frame_time - elapsed_time)
-
 
-    def update_from_stream(self) -> None:
+    def take_frame(self) -> RenderedFrame | None:
         """
-        Updates the view from the stream
-        :return None:
+        Takes the latest frame posted since the last call, must be called from the GUI thread
+        :return RenderedFrame | None:
         """
-        self.update_frame(self.stream_receiver.get_current_frame)
+        return self.frame_mailbox.take()
 
 
-    def update_from_system_camera(self) -> None:
+    def record_frame_displayed(self, rendered_frame: RenderedFrame) -> None:
         """
-        Updates the view from the system camera
+        Records the display time of the frame for the latency histograms
+        :param rendered_frame: frame with the timestamps copied when it was rendered
         :return None:
         """
-        self.update_frame(
-            lambda: cv2.resize(
-                cv2.cvtColor(self.system_camera.read()[1], cv2.COLOR_BGR2RGB),
-                self.tracking_frame_size,
-                cv2.INTER_LINEAR)
-            if self.system_camera and self.system_camera.read()[0]
-            else self.black_frame)
+        self.latency_monitor.record(rendered_frame.receive_time, rendered_frame.pts, rendered_frame.stamp, time.time())
+
+
+    def get_latency_summary(self) -> str:
+        return self.latency_monitor.summary()
 
 
     def set_tracking_frame_size(self, size):
-        self.tracking_frame_size = size
-        self.black_frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        self.camera_source.set_frame_size(size)
 
 
     def change_stream_url(self, stream_params) -> None:
@@ -153,18 +209,23 @@ class Viewer(QWidget):
         Play the stream
         :return None:
         """
+        self.source = self.select_source()
+        if self.source is None:
+            self.debug.send("Warning: No frame source is selected!")
+            return
+
         with self._is_playing_lock:
             self.is_playing = True
 
-        if self.ui.stream_check_box.isChecked():
-            self.stream_receiver.start(self.stream_url)
-            self.view_thread = threading.Thread(target=self.update_from_stream, daemon=True)
-        if self.ui.transmitter_check_box.isChecked():
-            self.view_thread = threading.Thread(target=self.update_from_system_camera, daemon=True)
-
-        if self.view_thread is None:
-            self.debug.send("Warning: View thread is None!")
-            return
+        self.source.start()
+        frame_size = self.source.get_frame_size()
+        if frame_size is not None:
+            self.source_frame_size_signal.emit(frame_size)
+        self.view_thread = threading.Thread(
+            target=self.update_frame, args=(self.source.wait_for_frame, self.source.get_frame_sequence()), daemon=True)
+        self.frame_mailbox.clear()
+        self.frame_mailbox.reset_dropped_count()
+        self.latency_monitor.reset()
         self.view_thread.start()
         self.play_pressed_signal.emit()
 
@@ -177,8 +238,14 @@ class Viewer(QWidget):
         with self._is_playing_lock:
             self.is_playing = False
 
-        if self.ui.stream_check_box.isChecked():
-            self.stream_receiver.stop()
+        if self.source is not None:
+            self.source.stop()
+
+        self.frame_mailbox.clear()
+        dropped_count = self.frame_mailbox.reset_dropped_count()
+        if dropped_count:
+            self.debug.send(f"{dropped_count} frames were dropped because the view was busy")
+        self.debug.send(f"Frame latency:\n{self.get_latency_summary()}")
 
         self.load_connection_established_view()
         self.stop_pressed_signal.emit()
@@ -1,5 +1,4 @@
-﻿from zeroconf import Zeroconf, ServiceBrowser, ServiceListener
-from src.mdns_listener import MDNSListener
+﻿from src.mdns_listener import MDNSListener
 
 from PySide6.QtCore import QObject
 
@@ -8,7 +7,7 @@ SERVICE_TYPE = "_http._tcp.local."
 class ZeroconfHandler(QObject):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.zeroconf = Zeroconf()
+        self.zeroconf = None
         self.listener = MDNSListener()
         self.browser = None
 
@@ -16,8 +15,11 @@ class ZeroconfHandler(QObject):
     def browse(self) -> None:
         """
         Starts browsing for available services or emitting existing data.
+        Zeroconf is imported and started here, on first use, to keep it out of the application startup
         :return None:
         """
+        from zeroconf import Zeroconf, ServiceBrowser
+
         if self.browser:
             self._clear_browser()
         if not self.zeroconf: